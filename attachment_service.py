@@ -1,38 +1,165 @@
 # attachment_service.py
+import io
 import os
+import asyncio
 import tempfile
 import base64
-import json
-import requests
+import multiprocessing
+from typing import BinaryIO, Optional
+import httpx
+from PIL import Image
 from telegram import Message
 from docx import Document
-import PyPDF2
 from config import Config
+from cache import LRUCache
+from db import Database
+from metrics import metrics
+import pdf_worker
+
+
+class ExtractionError(Exception):
+    """Не удалось извлечь текст; сообщение показывается пользователю и не кэшируется."""
+
+
+def prepare_image_for_ocr(data: bytes | memoryview, max_side: int, quality: int) -> Optional[bytes]:
+    """Уменьшает, переводит в оттенки серого и пережимает фото для OCR.
+
+    Возвращает новый JPEG или None, если выигрыша по размеру нет.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("L")
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    result = out.getvalue()
+    return result if len(result) < len(data) else None
 
 
 class AttachmentService:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, database: Optional[Database] = None):
         self.folder_id = config.YANDEX_FOLDER_ID
         self.iam_token = config.YANDEX_IAM_TOKEN  # ← НОВОЕ: IAM-токен напрямую
-        self.OCR_URL = "https://ocr.api.cloud.yandex.net/ocr/v1/recognizeText"
-
-    async def download_file(self, message: Message, file_obj) -> str:
-        file = await file_obj.get_file()
-        suffix = os.path.splitext(file.file_path)[1] or ".jpg"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            await file.download_to_drive(tmp.name)
-            print(f"[DOWNLOAD] Файл: {tmp.name} ({os.path.getsize(tmp.name)} байт)")
-            return tmp.name
-
-    def recognize_text_from_image(self, image_path: str) -> str:
-        """Твой проверенный метод OCR из vision.py"""
+        self.OCR_URL = config.OCR_URL
+        self.ocr_timeout = config.OCR_TIMEOUT
+        self.ocr_max_concurrency = config.OCR_MAX_CONCURRENCY
+        self.ocr_min_side = config.OCR_MIN_SIDE
+        self.ocr_max_side = config.OCR_MAX_SIDE
+        self.ocr_jpeg_quality = config.OCR_JPEG_QUALITY
+        self.ocr_bytes_saved = 0
+        self._ocr_semaphore = asyncio.Semaphore(self.ocr_max_concurrency)
+        self._client: httpx.AsyncClient | None = None
+        self.memory_limit = config.ATTACHMENT_MEMORY_LIMIT
+        self.max_chars = config.ATTACHMENT_MAX_CHARS
+        self.pdf_max_pages = config.PDF_MAX_PAGES
+        self.pdf_timeout = config.PDF_TIMEOUT
+        self._pdf_semaphore = asyncio.Semaphore(config.PDF_WORKERS)
+
+        self.db = database
+        self.cache_ttl = config.ATTACHMENT_CACHE_TTL
+        self.cache_rows = config.ATTACHMENT_CACHE_ROWS
+        self._text_cache = LRUCache(config.ATTACHMENT_CACHE_SIZE, ttl=config.ATTACHMENT_CACHE_TTL)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Общий клиент с keep-alive: TCP/TLS-соединение переиспользуется между фото
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.ocr_timeout,
+                limits=httpx.Limits(
+                    max_connections=self.ocr_max_concurrency,
+                    max_keepalive_connections=self.ocr_max_concurrency
+                )
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ── PDF ──────────────────────────────────────────────────────────
+    async def extract_pdf(self, buf: BinaryIO) -> str:
+        if isinstance(buf, io.BytesIO):
+            source = buf.getvalue()
+        else:
+            buf.flush()
+            source = buf.name
+        async with self._pdf_semaphore:
+            with metrics.timer('attachment', stage='pdf'):
+                return await asyncio.to_thread(self._extract_pdf_in_process, source)
+
+    def _extract_pdf_in_process(self, source: bytes | str) -> str:
+        # Каждый разбор — свой процесс: зависший PDF завершается по таймауту,
+        # не задевая файлы других пользователей, которые разбираются рядом
+        ctx = multiprocessing.get_context("spawn")
+        receiver, sender = ctx.Pipe(duplex=False)
+        proc = ctx.Process(
+            target=pdf_worker.run,
+            args=(sender, source, self.max_chars, self.pdf_max_pages, self.pdf_timeout),
+            daemon=True
+        )
+        proc.start()
+        sender.close()
+        try:
+            # Запас на запуск процесса; внутри разбор сам укладывается в pdf_timeout
+            if not receiver.poll(self.pdf_timeout + 5):
+                print(f"[PDF] Разбор не уложился в {self.pdf_timeout} с — завершаю процесс")
+                raise ExtractionError("PDF слишком сложный — не удалось прочитать его вовремя.")
+            ok, result = receiver.recv()
+        except EOFError:
+            # Процесс умер, ничего не прислав: нехватка памяти или сбой внутри PyPDF2
+            print("[PDF] Процесс разбора завершился, ничего не прислав")
+            raise ExtractionError("Не удалось прочитать PDF.")
+        finally:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+            receiver.close()
+        if not ok:
+            raise ExtractionError(f"Ошибка чтения: {result}")
+        return result
+
+    async def download_file(self, message: Message, file_obj) -> tuple[BinaryIO, str]:
+        """Скачивает файл в память; файлы больше ATTACHMENT_MEMORY_LIMIT — во временный файл.
+
+        Возвращает открытый буфер (закрывает вызывающий) и расширение файла.
+        """
+        with metrics.timer('attachment', stage='download'):
+            file = await file_obj.get_file()
+            suffix = os.path.splitext(file.file_path or "")[1] or ".jpg"
+            size = file.file_size or getattr(file_obj, 'file_size', None) or 0
+            if size > self.memory_limit:
+                # Временный файл удаляется сам при закрытии
+                buf = tempfile.NamedTemporaryFile(suffix=suffix)
+            else:
+                buf = io.BytesIO()
+            try:
+                await file.download_to_memory(out=buf)
+            except BaseException:
+                # Вызывающий буфер не получит — закрываем сами, иначе временный файл остаётся на диске
+                buf.close()
+                raise
+        buf.seek(0)
+        where = "диск" if size > self.memory_limit else "память"
+        print(f"[DOWNLOAD] Файл: {suffix} ({size} байт, {where})")
+        return buf, suffix
+
+    @staticmethod
+    def _read_buffer(buf: BinaryIO) -> bytes | memoryview:
+        # BytesIO отдаёт содержимое без копирования
+        if isinstance(buf, io.BytesIO):
+            return buf.getbuffer()
+        buf.seek(0)
+        return buf.read()
+
+    async def _ocr(self, image: bytes | memoryview, suffix: str) -> str:
         try:
             # --- Кодируем в Base64 ---
-            with open(image_path, "rb") as f:
-                content = base64.b64encode(f.read()).decode("utf-8")
+            content = base64.b64encode(image).decode("utf-8")
 
             # --- MIME-тип ---
-            ext = os.path.splitext(image_path)[1].lower()
+            ext = suffix.lower()
             mime_map = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
             mime_type = mime_map.get(ext, 'JPEG')
 
@@ -52,11 +179,18 @@ class AttachmentService:
             }
 
             print(f"[OCR] Отправка: {len(content)} байт, {mime_type}")
-            response = requests.post(self.OCR_URL, headers=headers, data=json.dumps(data), timeout=30)
+            # Время — вместе с ожиданием свободного места под OCR_MAX_CONCURRENCY
+            with metrics.timer('attachment', stage='ocr'):
+                async with self._ocr_semaphore:
+                    response = await asyncio.wait_for(
+                        self.client.post(self.OCR_URL, headers=headers, json=data),
+                        timeout=self.ocr_timeout
+                    )
 
             print(f"[OCR] Ответ: {response.status_code}")
 
             if response.status_code != 200:
+                metrics.inc('errors', source='attachment', stage='ocr')
                 try:
                     error = response.json().get("error", {})
                     code = error.get("code", "unknown")
@@ -64,58 +198,140 @@ class AttachmentService:
                 except:
                     code = "unknown"
                     message = response.text[:200]
-                return f"OCR ошибка {code}: {message}"
+                raise ExtractionError(f"OCR ошибка {code}: {message}")
 
             result = response.json()
             full_text = result.get("result", {}).get("textAnnotation", {}).get("fullText", "").strip()
-            return full_text if full_text else "Текст не найден на фото."
+            if not full_text:
+                raise ExtractionError("Текст не найден на фото.")
+            return full_text
 
+        except ExtractionError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"[OCR] Таймаут {self.ocr_timeout} с")
+            raise ExtractionError("OCR не ответил вовремя. Попробуй ещё раз.")
         except Exception as e:
             print(f"[OCR] Ошибка: {e}")
-            return f"Исключение: {str(e)}"
+            raise ExtractionError(f"Исключение: {str(e)}")
 
-    async def process_photo(self, message: Message) -> str:
-        photo = message.photo[-1]
-        path = await self.download_file(message, photo)
-        try:
-            return self.recognize_text_from_image(path)
-        finally:
-            if os.path.exists(path):
-                os.unlink(path)
+    # ── КЭШ ТЕКСТА ПО file_unique_id ─────────────────────────────────
+    async def _cached_text(self, file_unique_id: str) -> Optional[str]:
+        text = self._text_cache.get(file_unique_id)
+        if text is None and self.db is not None:
+            row = await self.db.get_attachment_text(file_unique_id, self.cache_ttl)
+            if row is not None:
+                text, age = row
+                # Срок жизни в памяти считаем от распознавания, а не от загрузки из БД
+                self._text_cache.set(file_unique_id, text, age=age)
+        if text is not None:
+            print(f"[CACHE] Текст вложения из кэша: {file_unique_id}")
+        return text
 
-    async def process_document(self, message: Message) -> str:
-        doc = message.document
-        path = await self.download_file(message, doc)
+    async def _remember_text(self, file_unique_id: str, text: str):
+        self._text_cache.set(file_unique_id, text)
+        if self.db is not None:
+            await self.db.save_attachment_text(file_unique_id, text, self.cache_ttl, self.cache_rows)
 
+    def _pick_photo_size(self, sizes):
+        """Самый маленький PhotoSize, которого хватает для OCR; иначе самый большой."""
+        for size in sorted(sizes, key=lambda p: p.width * p.height):
+            if max(size.width, size.height) >= self.ocr_min_side:
+                return size
+        return max(sizes, key=lambda p: p.width * p.height)
+
+    async def _prepare_image(self, data: bytes | memoryview, suffix: str) -> tuple[bytes | memoryview, str]:
         try:
-            mime = doc.mime_type or ""
-            name = (doc.file_name or "").lower()
+            with metrics.timer('attachment', stage='ocr_prepare'):
+                prepared = await asyncio.to_thread(prepare_image_for_ocr, data, self.ocr_max_side, self.ocr_jpeg_quality)
+        except Exception as e:
+            print(f"[OCR] Не удалось подготовить фото: {e}")
+            return data, suffix
+        if prepared is None:
+            return data, suffix
+        saved = len(data) - len(prepared)
+        self.ocr_bytes_saved += saved
+        print(f"[OCR] Фото сжато: {len(data)} → {len(prepared)} байт (−{saved})")
+        return prepared, ".jpg"
 
-            if "pdf" in mime or name.endswith(".pdf"):
-                with open(path, "rb") as f:
-                    reader = PyPDF2.PdfReader(f)
-                    text = " ".join(page.extract_text() or "" for page in reader.pages)
-                return text[:4000] or "PDF пустой."
+    async def process_photo(self, message: Message) -> str:
+        photo = self._pick_photo_size(message.photo)
+        cached = await self._cached_text(photo.file_unique_id)
+        if cached is not None:
+            return cached
 
-            elif "msword" in mime or "officedocument" in mime or name.endswith((".doc", ".docx")):
-                docx = Document(path)
-                text = " ".join(p.text for p in docx.paragraphs if p.text.strip())
-                return text[:4000] or "DOCX пустой."
+        buf, suffix = await self.download_file(message, photo)
+        with buf:
+            data = self._read_buffer(buf)
+            try:
+                image, image_suffix = await self._prepare_image(data, suffix)
+                text = await self._ocr(image, image_suffix)
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+        await self._remember_text(photo.file_unique_id, text)
+        return text
 
-            elif "text" in mime or name.endswith(".txt"):
-                with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                    return f.read()[:4000]
+    @staticmethod
+    def _document_kind(doc) -> Optional[str]:
+        mime = doc.mime_type or ""
+        name = (doc.file_name or "").lower()
+        if "pdf" in mime or name.endswith(".pdf"):
+            return "pdf"
+        if "msword" in mime or "officedocument" in mime or name.endswith((".doc", ".docx")):
+            return "docx"
+        if "text" in mime or name.endswith(".txt"):
+            return "txt"
+        return None
 
-            else:
-                return "Формат не поддерживается. Отправь PDF, DOCX, TXT или фото."
+    async def _parse_document(self, buf: BinaryIO, kind: str) -> str:
+        if kind == "pdf":
+            text = await self.extract_pdf(buf)
+            if not text:
+                raise ExtractionError("PDF пустой.")
+            return text
 
+        if kind == "docx":
+            with metrics.timer('attachment', stage='docx'):
+                docx = Document(buf)
+            text = " ".join(p.text for p in docx.paragraphs if p.text.strip())
+            if not text:
+                raise ExtractionError("DOCX пустой.")
+            return text[:self.max_chars]
+
+        # UTF-8 — не больше 4 байт на символ, остальное читать незачем
+        text = buf.read(self.max_chars * 4).decode("utf-8", errors="ignore")[:self.max_chars]
+        if not text.strip():
+            raise ExtractionError("Файл пустой.")
+        return text
+
+    async def process_document(self, message: Message) -> str:
+        doc = message.document
+        kind = self._document_kind(doc)
+        if kind is None:
+            raise ExtractionError("Формат не поддерживается. Отправь PDF, DOCX, TXT или фото.")
+
+        cached = await self._cached_text(doc.file_unique_id)
+        if cached is not None:
+            return cached
+
+        buf, _ = await self.download_file(message, doc)
+        try:
+            text = await self._parse_document(buf, kind)
+        except ExtractionError:
+            raise
         except Exception as e:
-            return f"Ошибка чтения: {str(e)}"
+            raise ExtractionError(f"Ошибка чтения: {str(e)}")
         finally:
-            if os.path.exists(path):
-                os.unlink(path)
+            buf.close()
+        await self._remember_text(doc.file_unique_id, text)
+        return text
+
+    def stats(self) -> dict:
+        return {**self._text_cache.stats(), 'ocr_bytes_saved': self.ocr_bytes_saved}
 
-    async def process_attachment(self, message: Message) -> str:
+    async def process_attachment(self, message: Message) -> Optional[str]:
+        """Текст фото или документа; ExtractionError — если прочитать не удалось."""
         if message.photo:
             return await self.process_photo(message)
         elif message.document:
@@ -0,0 +1,114 @@
+# benchmarks/bench_router.py
+"""Микробенчмарк маршрутизации текстовых сообщений.
+
+Проигрывает записанный поток (состояние диалога + текст сообщения) через
+Router и через прежний каскад сравнений из main.handle и печатает время
+на одно сообщение. С --max-ns завершается с ошибкой, если Router медленнее
+порога, — так регрессию видно сразу после добавления нового меню.
+
+    python benchmarks/bench_router.py
+    python benchmarks/bench_router.py --repeat 20000 --max-ns 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flows import MACHINE  # noqa: E402
+from router import Router, BACK_BUTTON, IDLE_BUTTONS, NCO_BUTTONS, SECTION_BUTTONS  # noqa: E402
+
+DEFAULT_STREAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_stream.jsonl")
+
+
+def load_stream(path: str) -> list[tuple]:
+    """Строки (текст, имя шага, номер шага); шаг в записи указан по имени из flows.py."""
+    with open(path, encoding="utf-8") as f:
+        rows = [row for row in map(json.loads, f) if row]
+    stream = []
+    for row in rows:
+        waiting = row.get("waiting")
+        state = MACHINE.by_name[waiting].id if waiting else None
+        stream.append((row.get("text"), waiting, state))
+    return stream
+
+
+def build_router() -> Router:
+    # Та же таблица, что в main, только вместо обработчиков — их имена
+    router = Router(default="menu")
+    router.on_button(BACK_BUTTON, "back")
+    router.on_button(NCO_BUTTONS, "nco_menu")
+    for button, flow in SECTION_BUTTONS.items():
+        router.on_button(button, f"start:{flow}")
+    router.on_button(IDLE_BUTTONS, "ignore", idle_only=True)
+    for flow in ("nco", "text", "image", "edit", "plan"):
+        router.on_flow(flow, f"step:{flow}")
+    return router
+
+
+def legacy_resolve(text, waiting):
+    """Каскад сравнений, которым main.handle выбирал обработчик раньше."""
+    if text == "🏠 Назад в главное меню":
+        return "back"
+    if text in ["🏠 Назад в главное меню", "⏭️ Пропустить", "🧹 Очистить"] and not waiting:
+        return "ignore"
+    if text in ["➕ Предоставить информацию об НКО", "👁️ Просмотреть информацию об НКО"]:
+        return "nco_menu"
+    if text in ["📝 Генерация текста", "🎨 Генерация изображения", "✏️ Редактор текста", "📅 Контент-план"]:
+        clean_text = text.replace("📝 ", "").replace("🎨 ", "").replace("✏️ ", "").replace("📅 ", "")
+        flow = ['text', 'image', 'edit', 'plan'][["Генерация текста", "Генерация изображения", "Редактор текста", "Контент-план"].index(clean_text)]
+        return f"start:{flow}"
+    waiting = waiting or ''
+    if waiting.startswith('nco_'):
+        return "step:nco"
+    elif waiting.startswith('text_') or waiting in ['select_style', 'text_prompt', 'select_post_type']:
+        return "step:text"
+    elif waiting.startswith('image_'):
+        return "step:image"
+    elif waiting.startswith('edit_'):
+        return "step:edit"
+    elif waiting.startswith('plan_'):
+        return "step:plan"
+    return "menu"
+
+
+def bench(resolve, stream: list[tuple], repeat: int) -> float:
+    """Среднее время маршрутизации одного сообщения, нс."""
+    started = time.perf_counter_ns()
+    for _ in range(repeat):
+        for text, state in stream:
+            resolve(text, state)
+    return (time.perf_counter_ns() - started) / (repeat * len(stream))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stream", default=DEFAULT_STREAM, help="JSONL с полями text и waiting")
+    parser.add_argument("--repeat", type=int, default=5000, help="сколько раз проиграть поток")
+    parser.add_argument("--max-ns", type=float, default=None, help="порог для Router, нс на сообщение")
+    args = parser.parse_args()
+
+    stream = load_stream(args.stream)
+    router = build_router()
+
+    # Маршруты должны совпадать с прежними, кроме состояний, которые каскад терял
+    for text, waiting, state in stream:
+        new, old = router.resolve(text, state), legacy_resolve(text, waiting)
+        if new != old:
+            print(f"  расхождение: waiting={waiting!r} text={text!r}: {old} → {new}")
+
+    legacy_ns = bench(legacy_resolve, [(text, waiting) for text, waiting, _ in stream], args.repeat)
+    router_ns = bench(router.resolve, [(text, state) for text, _, state in stream], args.repeat)
+    print(f"Сообщений в потоке: {len(stream)}, повторов: {args.repeat}")
+    print(f"Каскад сравнений: {legacy_ns:8.1f} нс/сообщение")
+    print(f"Router:           {router_ns:8.1f} нс/сообщение  (×{legacy_ns / router_ns:.1f})")
+
+    if args.max_ns is not None and router_ns > args.max_ns:
+        print(f"Router медленнее порога {args.max_ns} нс")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+# benchmarks/fakes.py
+"""Заглушки внешних сервисов для нагрузочного теста (benchmarks/loadtest.py).
+
+FakeBotAPI и FakeOCR — настоящие HTTP-серверы на asyncio, бот ходит к ним
+по сети через TELEGRAM_API_URL и OCR_URL. YandexGPT и yandex-art SDK
+вызывает по gRPC, поэтому их заменяет FakeYCloudML прямо в процессе бота.
+Задержки всех заглушек — логнормальные (медиана и разброс).
+"""
+import asyncio
+import io
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Callable, Optional
+from urllib.parse import parse_qsl
+
+
+class Latency:
+    """Логнормальная задержка: median — медиана в секундах, sigma — разброс."""
+
+    def __init__(self, median: float, sigma: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """«1.5» или «1.5:0.4» (медиана:разброс)."""
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma or 0.0))
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def __str__(self):
+        return f"{self.median:g}:{self.sigma:g}"
+
+
+# ── HTTP ─────────────────────────────────────────────────────────────
+class FakeHTTPServer:
+    """Минимальный HTTP/1.1-сервер с keep-alive: ровно столько, сколько нужно httpx."""
+
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+
+    def __init__(self):
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+        self.requests = 0
+        # Keep-alive соединения: server.close() их не трогает, закрываем в stop()
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for task, writer in self._connections.items():
+                writer.close()
+                task.cancel()
+            # До wait_closed: с Python 3.12 он ждёт, пока закроются все соединения
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, str, bytes]:
+        raise NotImplementedError
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, path, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get("transfer-encoding", "").lower() == "chunked":
+                    body = await self._read_chunked(reader)
+                else:
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                self.requests += 1
+                status, content_type, payload = await self.handle(method, path, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {self.REASONS.get(status, 'OK')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Отмена приходит только из stop(); задачу соединения никто не ждёт,
+            # поэтому завершаем её обычным образом — иначе asyncio пишет ошибку в лог
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                return b"".join(chunks)
+            chunks.append(chunk[:-2])
+
+
+def json_response(data, status: int = 200) -> tuple[int, str, bytes]:
+    return status, "application/json", json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def parse_params(headers: dict, body: bytes) -> dict:
+    """Параметры запроса к Bot API: JSON, form-urlencoded или multipart (отправка файлов)."""
+    content_type = headers.get("content-type", "")
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+        raw = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            raw[name] = payload if part.get_filename() else payload.decode("utf-8")
+    else:
+        raw = dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+    # Составные значения (reply_markup, chat_id) PTB передаёт строкой JSON
+    params = {}
+    for name, value in raw.items():
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[name] = value
+    return params
+
+
+# ── TELEGRAM BOT API ─────────────────────────────────────────────────
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Методы, которые отправляют или меняют сообщение в чате
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageCaption"}
+
+
+class FakeBotAPI(FakeHTTPServer):
+    """Bot API: отдаёт боту обновления через getUpdates и принимает его ответы.
+
+    Каждый ответ бота в чат передаётся в on_reply(chat_id, method, params) —
+    так виртуальный пользователь узнаёт, что шаг сценария завершён.
+    """
+
+    def __init__(self, latency: Latency = None):
+        super().__init__()
+        self.latency = latency or Latency(0)
+        self.on_reply: Optional[Callable[[int, str, dict], None]] = None
+        self.calls = Counter()
+        self.pushed = 0
+        self.delivered = 0
+        self._updates: list[dict] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._files: dict[str, tuple[bytes, str]] = {}
+
+    # ── ЧТО ПРИСЫЛАЮТ ПОЛЬЗОВАТЕЛИ ───────────────────────────────────
+    def push(self, update: dict):
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self.pushed += 1
+        self._new_updates.set()
+
+    def add_file(self, data: bytes, suffix: str) -> tuple[str, str]:
+        """Регистрирует файл для getFile; возвращает (file_id, file_unique_id)."""
+        n = next(self._file_ids)
+        file_id = f"file{n}"
+        self._files[file_id] = (data, suffix)
+        return file_id, f"unique{n}"
+
+    def message_update(self, user_id: int, text: str = None, photo: tuple = None, document: dict = None) -> dict:
+        """Личное сообщение пользователя: текст, фото (file_id, file_unique_id, size) или документ."""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        }
+        if text is not None:
+            message["text"] = text
+        if photo is not None:
+            file_id, unique_id, size = photo
+            message["photo"] = [
+                {"file_id": f"{file_id}s", "file_unique_id": f"{unique_id}s", "width": 320, "height": 240},
+                {"file_id": file_id, "file_unique_id": unique_id, "width": 1280, "height": 960, "file_size": size},
+            ]
+        if document is not None:
+            message["document"] = document
+        return {"message": message}
+
+    # ── ЧТО ВЫЗЫВАЕТ БОТ ─────────────────────────────────────────────
+    async def handle(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, str, bytes]:
+        if path.startswith("/file/"):
+            file_id = path.rsplit("/", 1)[-1].split(".")[0]
+            if file_id not in self._files:
+                return 404, "text/plain", b"not found"
+            return 200, "application/octet-stream", self._files[file_id][0]
+
+        api_method = path.rstrip("/").rsplit("/", 1)[-1]
+        params = parse_params(headers, body)
+        self.calls[api_method] += 1
+        if api_method == "getUpdates":
+            return json_response({"ok": True, "result": await self._get_updates(params)})
+
+        await asyncio.sleep(self.latency.sample())
+        result = self._result(api_method, params)
+        if api_method in MESSAGE_METHODS and self.on_reply is not None:
+            self.on_reply(int(params.get("chat_id", 0)), api_method, params)
+        return json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        batch = self._updates[:int(params.get("limit") or 100)]
+        # Номера обновлений идут подряд: доставлено столько, каков наибольший выданный номер
+        self.delivered = max(self.delivered, batch[-1]["update_id"] if batch else 0)
+        return batch
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getFile":
+            file_id = params.get("file_id")
+            data, suffix = self._files.get(file_id, (b"", ".bin"))
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(data),
+                    "file_path": f"files/{file_id}{suffix}"}
+        if method in MESSAGE_METHODS:
+            message = {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = str(params["text"])
+            if method == "sendPhoto":
+                n = next(self._file_ids)
+                message["photo"] = [{"file_id": f"sent{n}", "file_unique_id": f"sentu{n}", "width": 512, "height": 1024}]
+                message["caption"] = str(params.get("caption", ""))
+            return message
+        # deleteMessage, answerCallbackQuery, deleteWebhook и прочие
+        return True
+
+
+# ── OCR ──────────────────────────────────────────────────────────────
+class FakeOCR(FakeHTTPServer):
+    """Yandex Vision OCR: отвечает через latency фиксированным текстом."""
+
+    TEXT = "Субботник в парке: собираемся в 10:00 у главного входа, перчатки и мешки выдадим на месте."
+
+    def __init__(self, latency: Latency = None):
+        super().__init__()
+        self.latency = latency or Latency(0)
+        self.bytes_received = 0
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, str, bytes]:
+        self.bytes_received += len(body)
+        await asyncio.sleep(self.latency.sample())
+        return json_response({"result": {"textAnnotation": {"fullText": self.TEXT}}})
+
+
+# ── YANDEX CLOUD ML SDK ──────────────────────────────────────────────
+class _Alternative:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Result:
+    __slots__ = ("alternatives", "image_bytes")
+
+    def __init__(self, text: str = "", image_bytes: bytes = b""):
+        self.alternatives = [_Alternative(text)]
+        self.image_bytes = image_bytes
+
+
+class FakeCompletions:
+    """models.completions('yandexgpt'): run и run_stream с задержкой вместо запроса."""
+
+    def __init__(self, latency: Latency, chunks: int = 5):
+        self.latency = latency
+        self.chunks = chunks
+        self.calls = 0
+
+    def configure(self, **kwargs) -> "FakeCompletions":
+        return self
+
+    @staticmethod
+    def answer(prompt) -> str:
+        prompt = str(prompt)
+        if "одним словом" in prompt:
+            return "ок"
+        if "контент-план" in prompt.lower():
+            return "\n".join(f"[{day:02d}.12] — Идея поста номер {day}" for day in range(1, 8))
+        return ("Друзья, приглашаем всех на субботник! Вместе сделаем наш парк чище. "
+                "Приходите с друзьями и хорошим настроением.\n\n#НКО #добро #волонтёры")
+
+    async def run(self, prompt) -> _Result:
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        return _Result(self.answer(prompt))
+
+    async def run_stream(self, prompt):
+        self.calls += 1
+        text = self.answer(prompt)
+        pause = self.latency.sample() / self.chunks
+        for i in range(1, self.chunks + 1):
+            await asyncio.sleep(pause)
+            yield _Result(text[:len(text) * i // self.chunks])
+
+
+class _Operation:
+    def __init__(self, latency: float, image_bytes: bytes):
+        self.latency = latency
+        self.image_bytes = image_bytes
+
+    async def _wait(self) -> _Result:
+        await asyncio.sleep(self.latency)
+        return _Result(image_bytes=self.image_bytes)
+
+    def __await__(self):
+        return self._wait().__await__()
+
+
+class FakeImageGeneration:
+    """models.image_generation('yandex-art'): run_deferred возвращает операцию с задержкой."""
+
+    def __init__(self, latency: Latency, image_bytes: bytes):
+        self.latency = latency
+        self.image_bytes = image_bytes
+        self.calls = 0
+
+    def configure(self, **kwargs) -> "FakeImageGeneration":
+        return self
+
+    async def run_deferred(self, prompt) -> _Operation:
+        self.calls += 1
+        return _Operation(self.latency.sample(), self.image_bytes)
+
+
+class FakeYCloudML:
+    """Подменяет AsyncYCloudML в text_service и image_service (см. install)."""
+
+    completions_model: FakeCompletions = None
+    image_model: FakeImageGeneration = None
+
+    def __init__(self, folder_id: str = "", auth: str = ""):
+        self.models = self
+
+    def setup_default_logging(self):
+        pass
+
+    def completions(self, name: str) -> FakeCompletions:
+        return self.completions_model
+
+    def image_generation(self, name: str) -> FakeImageGeneration:
+        return self.image_model
+
+    @classmethod
+    def install(cls, text_latency: Latency, image_latency: Latency) -> "type[FakeYCloudML]":
+        import image_service
+        import text_service
+        cls.completions_model = FakeCompletions(text_latency)
+        cls.image_model = FakeImageGeneration(image_latency, sample_jpeg(512, 1024))
+        text_service.AsyncYCloudML = cls
+        image_service.AsyncYCloudML = cls
+        return cls
+
+
+def sample_jpeg(width: int = 1280, height: int = 960) -> bytes:
+    """Картинка с градиентом: достаточно «живая», чтобы JPEG не сжимался в ноль."""
+    from PIL import Image
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
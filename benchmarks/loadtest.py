@@ -0,0 +1,279 @@
+# benchmarks/loadtest.py
+"""Нагрузочный тест бота без сети: заглушки Telegram, OCR и моделей Yandex.
+
+Бот собирается как в main (build_application) и ходит в FakeBotAPI и FakeOCR
+по HTTP; модели подменены в процессе (см. fakes.py). Заглушки и виртуальные
+пользователи работают в отдельном потоке со своим event loop, так что
+задержка event loop, которую меряет тест, — это задержка самого бота.
+
+Пользователи приходят потоком Пуассона с частотой --rate и проходят
+сценарии из scenarios.py. В конце печатаются обновления в секунду,
+перцентили времени ответа по шагам и задержка event loop.
+С --max-p95-ms завершается с ошибкой, если какой-либо шаг медленнее порога.
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --users 500 --rate 50 --mix text=3,image=1,photo --gpt 2:0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config  # noqa: E402
+from fakes import FakeBotAPI, FakeOCR, FakeYCloudML, Latency, sample_jpeg  # noqa: E402
+from main import build_application  # noqa: E402
+from scenarios import FAIL_MARKERS, SCENARIOS, Step, parse_mix  # noqa: E402
+
+DOCUMENT_TEXT = ("Отчёт о субботнике: пришли 40 волонтёров, собрали 120 мешков мусора, "
+                 "высадили 15 деревьев. Следующая встреча — через месяц.\n").encode("utf-8")
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу; values отсортированы."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def make_config(api_url: str, ocr_url: str, workdir: str) -> Config:
+    # Необязательные настройки (AI_MAX_CONCURRENCY, IMAGE_WORKERS, ...) берутся из окружения, как у бота
+    values = Config._optional_from_env()
+    values.update(
+        BOT_MODE="polling",
+        TELEGRAM_API_URL=api_url,
+        OCR_URL=f"{ocr_url}/ocr/v1/recognizeText",
+        DB_PATH=os.path.join(workdir, "loadtest.db"),
+        IMAGE_CACHE_DIR=os.path.join(workdir, "image_cache"),
+    )
+    return Config(
+        TELEGRAM_BOT_TOKEN="0:loadtest",
+        YANDEX_FOLDER_ID="loadtest",
+        YANDEX_OAUTH_TOKEN="loadtest",
+        YANDEX_IAM_TOKEN="loadtest",
+        **values
+    )
+
+
+class Driver:
+    """Виртуальные пользователи: шлют обновления в FakeBotAPI и ждут ответов бота."""
+
+    def __init__(self, api: FakeBotAPI, mix: dict[str, float], users: int, rate: float,
+                 think: float, step_timeout: float):
+        self.api = api
+        self.mix = mix
+        self.users = users
+        self.rate = rate
+        self.think = think
+        self.step_timeout = step_timeout
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors = Counter()
+        self.sessions = Counter()
+        self.failed_sessions = Counter()
+        self._inboxes: dict[int, asyncio.Queue] = {}
+        self._photo = b""
+        api.on_reply = self._on_reply
+
+    def _on_reply(self, chat_id: int, method: str, params: dict):
+        inbox = self._inboxes.get(chat_id)
+        if inbox is not None:
+            inbox.put_nowait(str(params.get("text") or params.get("caption") or ""))
+
+    def _update(self, user_id: int, n: int, step: Step) -> dict:
+        if step.photo:
+            file_id, unique_id = self.api.add_file(self._photo, ".jpg")
+            return self.api.message_update(user_id, photo=(file_id, unique_id, len(self._photo)))
+        if step.document:
+            data = DOCUMENT_TEXT + f"Сессия {n}.".encode("utf-8")
+            file_id, unique_id = self.api.add_file(data, ".txt")
+            return self.api.message_update(user_id, document={
+                "file_id": file_id, "file_unique_id": unique_id, "file_name": "report.txt",
+                "mime_type": "text/plain", "file_size": len(data),
+            })
+        return self.api.message_update(user_id, text=step.text)
+
+    async def _wait_reply(self, inbox: asyncio.Queue, expect: str) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.step_timeout
+        while True:
+            text = await asyncio.wait_for(inbox.get(), timeout=max(0.0, deadline - loop.time()))
+            if expect in text:
+                return True
+            if any(marker in text for marker in FAIL_MARKERS):
+                return False
+
+    async def session(self, n: int, scenario: str):
+        user_id = 100_000 + n
+        inbox = self._inboxes[user_id] = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self.sessions[scenario] += 1
+        try:
+            for step in SCENARIOS[scenario](n):
+                if self.think > 0:
+                    await asyncio.sleep(random.expovariate(1 / self.think))
+                while not inbox.empty():
+                    inbox.get_nowait()
+                stage = f"{scenario}:{step.name}"
+                started = loop.time()
+                self.api.push(self._update(user_id, n, step))
+                try:
+                    ok = await self._wait_reply(inbox, step.expect)
+                except asyncio.TimeoutError:
+                    ok = False
+                self.latencies[stage].append(loop.time() - started)
+                if not ok:
+                    self.errors[stage] += 1
+                    self.failed_sessions[scenario] += 1
+                    return
+        finally:
+            del self._inboxes[user_id]
+
+    async def run(self) -> float:
+        """Запускает всех пользователей и ждёт завершения; возвращает длительность, с."""
+        self._photo = await asyncio.to_thread(sample_jpeg)
+        names, weights = list(self.mix), list(self.mix.values())
+        started = time.perf_counter()
+        tasks = []
+        for n in range(self.users):
+            tasks.append(asyncio.create_task(self.session(n, random.choices(names, weights)[0])))
+            await asyncio.sleep(random.expovariate(self.rate))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+async def monitor_lag(samples: list[float], interval: float):
+    """Насколько позже запланированного просыпается event loop бота."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+class Harness:
+    """Отдельный поток с event loop для заглушек и виртуальных пользователей."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="loadtest-harness", daemon=True)
+        self.thread.start()
+
+    async def call(self, coro):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+async def run(args) -> dict:
+    harness = Harness()
+    api = FakeBotAPI(Latency.parse(args.telegram))
+    ocr = FakeOCR(Latency.parse(args.ocr))
+    await harness.call(api.start())
+    await harness.call(ocr.start())
+    sdk = FakeYCloudML.install(Latency.parse(args.gpt), Latency.parse(args.art))
+
+    lag: list[float] = []
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        app = build_application(make_config(api.url, ocr.url, workdir))
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        await app.start()
+        monitor = asyncio.create_task(monitor_lag(lag, args.lag_interval))
+
+        driver = Driver(api, parse_mix(args.mix), args.users, args.rate, args.think, args.step_timeout)
+        try:
+            duration = await harness.call(driver.run())
+        finally:
+            monitor.cancel()
+            stats = {
+                'scheduler': app.bot_data['ai_scheduler'].stats(),
+                'image_jobs': app.bot_data['image_jobs'].stats(),
+            }
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+            await harness.call(api.stop())
+            await harness.call(ocr.stop())
+            harness.close()
+
+    return {
+        'duration': duration, 'driver': driver, 'api': api, 'ocr': ocr, 'lag': sorted(lag), 'stats': stats,
+        'model_calls': {'gpt': sdk.completions_model.calls, 'art': sdk.image_model.calls},
+    }
+
+
+def report(result: dict, max_p95_ms: float = None) -> bool:
+    driver, api, ocr = result['driver'], result['api'], result['ocr']
+    duration = result['duration']
+    sessions = sum(driver.sessions.values())
+    failed = sum(driver.failed_sessions.values())
+    print(f"Сессий: {sessions} (с ошибкой: {failed}) за {duration:.1f} с")
+    print(f"Обновлений: {api.delivered}, {api.delivered / duration:.1f}/с; "
+          f"вызовов Bot API: {sum(api.calls.values())}, запросов OCR: {ocr.requests}, "
+          f"GPT: {result['model_calls']['gpt']}, ART: {result['model_calls']['art']}")
+
+    print(f"\n{'шаг':<22}{'n':>6}{'ошибок':>8}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  мс")
+    ok = True
+    for stage in sorted(driver.latencies):
+        values = sorted(driver.latencies[stage])
+        p = [percentile(values, q) * 1000 for q in (50, 90, 95, 99, 100)]
+        slow = max_p95_ms is not None and p[2] > max_p95_ms
+        ok = ok and not slow
+        print(f"{stage:<22}{len(values):>6}{driver.errors[stage]:>8}" + "".join(f"{v:>9.0f}" for v in p)
+              + ("  ← медленнее порога" if slow else ""))
+
+    lag = result['lag']
+    print(f"\nЗадержка event loop: p50 {percentile(lag, 50) * 1000:.1f} мс, "
+          f"p99 {percentile(lag, 99) * 1000:.1f} мс, max {percentile(lag, 100) * 1000:.1f} мс ({len(lag)} замеров)")
+    print(f"Bot API: {', '.join(f'{m} {c}' for m, c in api.calls.most_common())}")
+    for name, stats in result['stats'].items():
+        print(f"{name}: {', '.join(f'{k}={v:.3g}' if isinstance(v, float) else f'{k}={v}' for k, v in stats.items())}")
+    return ok and not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="сколько сессий провести")
+    parser.add_argument("--rate", type=float, default=20.0, help="новых сессий в секунду (в среднем)")
+    parser.add_argument("--mix", default=",".join(SCENARIOS), help="сценарии с весами: text=3,image=1,photo")
+    parser.add_argument("--think", type=float, default=0.5, help="средняя пауза пользователя между шагами, с")
+    parser.add_argument("--step-timeout", type=float, default=120.0, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--gpt", default="1.5:0.4", help="задержка YandexGPT, медиана:разброс (с)")
+    parser.add_argument("--art", default="8:0.3", help="задержка yandex-art")
+    parser.add_argument("--ocr", default="0.8:0.3", help="задержка OCR")
+    parser.add_argument("--telegram", default="0.03:0.3", help="задержка ответа Bot API")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="период замера задержки event loop, с")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="порог p95 для любого шага, мс")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать логи бота")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Бот печатает отладку в stdout ([OCR], [ART], ...) — без --verbose она не нужна
+    with open(os.devnull, "w") as devnull:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+            result = asyncio.run(run(args))
+    if not report(result, args.max_p95_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
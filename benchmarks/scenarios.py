@@ -0,0 +1,102 @@
+# benchmarks/scenarios.py
+"""Сценарии виртуальных пользователей для benchmarks/loadtest.py.
+
+Сценарий — список шагов: что пользователь присылает и по какой подстроке
+в ответе бота (текст или подпись) шаг считается завершённым. Промпты
+содержат номер сессии, чтобы не попадать в кэши ответов и картинок.
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+@dataclass
+class Step:
+    name: str
+    expect: str
+    text: Optional[str] = None
+    photo: bool = False
+    document: bool = False
+
+
+# Ответ бота с такими отметками — ошибка шага (😕 — неудачная генерация, ❌ — ошибка ввода или файла)
+FAIL_MARKERS = ("😕", "❌")
+
+
+def text_scenario(n: int) -> list[Step]:
+    return [
+        Step("menu", "Что тебе больше подходит", text="📝 Генерация текста"),
+        Step("mode", "Просто опиши идею", text="💬 Свободный текст"),
+        Step("prompt", "Детали сохранены", text=f"Субботник в парке в эту субботу, нужны волонтёры (сессия {n})"),
+        Step("generate", "Если нужно что-то доработать", text="💬 Разговорный"),
+    ]
+
+
+def image_scenario(n: int) -> list[Step]:
+    return [
+        Step("menu", "Опиши, что хочешь увидеть", text="🎨 Генерация изображения"),
+        Step("prompt", "Запомнил твоё описание", text=f"Волонтёры сажают деревья в парке, солнечный день (сессия {n})"),
+        Step("generate", "Нравится результат", text="💧 Акварель"),
+    ]
+
+
+def edit_scenario(n: int) -> list[Step]:
+    return [
+        Step("menu", "Пришли текст", text="✏️ Редактор текста"),
+        Step("text", "Текст сохранён", text=f"Сегодня мы помогли 10 животным. Спасибо всем волонтёрам! (сессия {n})"),
+        Step("apply", "Готово!", text="✅ Исправить ошибки"),
+    ]
+
+
+def plan_scenario(n: int) -> list[Step]:
+    return [
+        Step("menu", "Сначала напиши", text="📅 Контент-план"),
+        Step("theme", "Тема:", text=f"Помощь бездомным животным (сессия {n})"),
+        Step("period", "частоту публикаций", text="📅 Неделя"),
+        Step("generate", "Если нужно что-то изменить", text="📅 1 раз в день"),
+    ]
+
+
+def nco_scenario(n: int) -> list[Step]:
+    return [
+        Step("menu", "Начнём с названия", text="➕ Предоставить информацию об НКО"),
+        Step("name", "Деятельность НКО", text=f"Добрые лапы {n}"),
+        Step("activities", "Целевая аудитория", text="Приют для бездомных животных, поиск хозяев"),
+        Step("audience", "Сайт НКО", text="Жители города, волонтёры, партнёры"),
+        Step("website", "Всё сохранено", text="https://example.org"),
+    ]
+
+
+def photo_scenario(n: int) -> list[Step]:
+    return [
+        Step("ocr", "Выбери стиль для поста", photo=True),
+        Step("generate", "Если нужно что-то доработать", text="⚪ Без стиля"),
+    ]
+
+
+def document_scenario(n: int) -> list[Step]:
+    return [
+        Step("parse", "Выбери стиль для поста", document=True),
+        Step("generate", "Если нужно что-то доработать", text="📋 Официально-деловой"),
+    ]
+
+
+SCENARIOS: dict[str, Callable[[int], list[Step]]] = {
+    'text': text_scenario,
+    'image': image_scenario,
+    'edit': edit_scenario,
+    'plan': plan_scenario,
+    'nco': nco_scenario,
+    'photo': photo_scenario,
+    'document': document_scenario,
+}
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """«text=3,image=1,photo» → веса сценариев; вес по умолчанию 1."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Неизвестный сценарий: {name} (есть: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1.0)
+    return mix
@@ -1,12 +1,12 @@
 import sys
 import asyncio
 from config import Config
-from ai_service import AIService
+from text_service import TextService
 
 async def check_ai_api():
     try:
         config = Config.from_env()
-        ai_service = AIService(config)
+        ai_service = TextService(config)
         result = await ai_service.check_health()
         print('✅ Yandex AI API доступен.' if result else '❌ Yandex AI API недоступен.')
         return result
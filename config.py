@@ -1,6 +1,6 @@
 # config.py
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, MISSING
 
 
 @dataclass
@@ -20,6 +20,74 @@ class Config:
         "Кроме того, предложи пользователю идеи визуалов для соцсетей и пиши эту информацию ниже от поста, отделив её с помощью эмодзи и при перечислении используй цифры."
     )
 
+    # ── ПРИЁМ ОБНОВЛЕНИЙ ─────────────────────────────────────────────
+    BOT_MODE: str = "polling"          # polling | webhook
+    WEBHOOK_URL: str = ""              # внешний адрес, например https://bot.example.org
+    WEBHOOK_PATH: str = "telegram"
+    WEBHOOK_LISTEN: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8443
+    WEBHOOK_SECRET: str = ""           # сверяется с X-Telegram-Bot-Api-Secret-Token
+    UPDATE_QUEUE_SIZE: int = 0         # 0 — очередь без ограничения
+    UPDATE_CONCURRENCY: int = 64       # сколько обновлений обрабатывается одновременно
+                                       # (обновления одного пользователя — всегда по очереди)
+    UPDATE_MAX_PENDING: int = 1000     # обновлений в работе вместе с ждущими своей очереди
+    AI_MAX_CONCURRENCY: int = 8        # одновременных запросов к YandexGPT и yandex-art вместе
+    AI_USER_RATE: float = 0.5          # «цены» запросов в секунду на пользователя (правка — 1, картинка — 10)
+    AI_USER_BURST: float = 20.0        # запас на всплеск, дальше запросы отклоняются до пополнения
+    AI_CHAT_RATE: float = 1.0          # то же для группового чата целиком
+    AI_CHAT_BURST: float = 40.0
+    PERSISTENCE_INTERVAL: float = 30.0  # секунд между сохранениями состояния диалогов
+    TELEGRAM_API_URL: str = ""         # свой сервер Bot API, например http://localhost:8081; пусто — api.telegram.org
+    DB_PATH: str = "nco_data.db"
+
+    # ── ГЕНЕРАЦИЯ ТЕКСТА ─────────────────────────────────────────────
+    TEXT_TIMEOUT: float = 60.0         # секунд на один запрос
+    TEXT_MAX_TOKENS: int = 1500        # резерв токенов под ответ модели
+    MODEL_CONTEXT_TOKENS: int = 8000   # окно контекста модели: промт + ответ
+    TEXT_CACHE_SIZE: int = 512         # ответов в кэше; 0 — кэш выключен
+    TEXT_CACHE_TTL: float = 3600.0     # секунд жизни ответа в кэше
+    TEXT_CACHE_SKIP_ACTIONS: tuple = ("Перефразировать",)  # действия редактора без кэша
+    TEXT_CACHE_KINDS: tuple = ("edit", "plan")  # что кэшируется; новый пост каждый раз пишется заново
+
+    # ── КОНТЕНТ-ПЛАН ─────────────────────────────────────────────────
+    PLAN_MAX_POSTS: int = 90           # идей в одном плане
+    PLAN_CHUNK_SIZE: int = 10          # идей в одном запросе к модели
+    PLAN_CHUNK_CONCURRENCY: int = 3    # частей плана, генерируемых одновременно
+
+    # ── OCR ──────────────────────────────────────────────────────────
+    OCR_URL: str = "https://ocr.api.cloud.yandex.net/ocr/v1/recognizeText"
+    OCR_MAX_CONCURRENCY: int = 4       # одновременных запросов к OCR
+    OCR_TIMEOUT: float = 30.0          # секунд на распознавание одного фото
+    OCR_MIN_SIDE: int = 1280           # берём самый маленький размер фото с такой длинной стороной
+    OCR_MAX_SIDE: int = 2048           # больше — уменьшаем перед отправкой
+    OCR_JPEG_QUALITY: int = 85
+
+    # ── ВЛОЖЕНИЯ ─────────────────────────────────────────────────────
+    ATTACHMENT_MEMORY_LIMIT: int = 10 * 1024 * 1024  # байт; файлы больше пишутся на диск
+    ATTACHMENT_MAX_CHARS: int = 4000   # сколько символов текста берём из документа
+    PDF_MAX_PAGES: int = 30            # дальше этой страницы PDF не читаем
+    PDF_TIMEOUT: float = 15.0          # секунд на разбор одного PDF
+    PDF_WORKERS: int = 2               # PDF разбирается одновременно, каждый в своём процессе
+    MEDIA_GROUP_WINDOW: float = 1.0    # секунд ждём остальные фото альбома
+    ATTACHMENT_CACHE_SIZE: int = 1000  # извлечённых текстов в памяти
+    ATTACHMENT_CACHE_ROWS: int = 20000 # извлечённых текстов в БД
+    ATTACHMENT_CACHE_TTL: float = 7 * 24 * 3600.0
+
+    # ── КАРТИНКИ ─────────────────────────────────────────────────────
+    IMAGE_CACHE_DIR: str = "image_cache"
+    IMAGE_CACHE_MAX_BYTES: int = 200 * 1024 * 1024
+    IMAGE_WORKERS: int = 2             # картинок генерируется одновременно
+    IMAGE_QUEUE_SIZE: int = 100        # задач ждёт в очереди, дальше — отказ
+    IMAGE_JOBS_PER_USER: int = 2       # задач одного пользователя в очереди и в работе
+    IMAGE_PROGRESS_INTERVAL: float = 15.0  # секунд между обновлениями статуса во время генерации
+
+    # ── МЕТРИКИ ──────────────────────────────────────────────────────
+    METRICS_ENABLED: bool = False      # выключено — замеры почти ничего не стоят
+    METRICS_PORT: int = 0              # >0 — отдавать /metrics в формате Prometheus
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_LOG_INTERVAL: float = 0.0  # >0 — раз в столько секунд писать сводку в лог строкой JSON
+    LOOP_LAG_INTERVAL: float = 0.5     # секунд между замерами задержки event loop
+
     @classmethod
     def from_env(cls):
         token = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -36,9 +104,36 @@ class Config:
             }.items() if not v]
             raise ValueError(f"Отсутствуют: {', '.join(missing)}")
 
+        optional = cls._optional_from_env()
+        if optional.get('BOT_MODE') == 'webhook':
+            missing = [k for k in ('WEBHOOK_URL', 'WEBHOOK_SECRET') if not optional.get(k)]
+            if missing:
+                raise ValueError(f"Для режима webhook отсутствуют: {', '.join(missing)}")
+
         return cls(
             TELEGRAM_BOT_TOKEN=token,
             YANDEX_FOLDER_ID=folder_id,
             YANDEX_OAUTH_TOKEN=oauth_token,
-            YANDEX_IAM_TOKEN=iam_token
+            YANDEX_IAM_TOKEN=iam_token,
+            **optional
         )
+
+    @classmethod
+    def _optional_from_env(cls) -> dict:
+        """Необязательные настройки: переопределяются переменной окружения с тем же именем."""
+        values = {}
+        for f in fields(cls):
+            if f.default is MISSING:
+                continue
+            raw = os.getenv(f.name)
+            if raw is None or raw == "":
+                continue
+            if isinstance(f.default, tuple):
+                values[f.name] = tuple(v.strip() for v in raw.split(",") if v.strip())
+            elif isinstance(f.default, bool):
+                values[f.name] = raw.strip().lower() in ("1", "true", "yes", "on")
+            elif isinstance(f.default, (int, float)):
+                values[f.name] = type(f.default)(raw)
+            else:
+                values[f.name] = raw
+        return values
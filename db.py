@@ -1,15 +1,34 @@
 # db.py
+import asyncio
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+from cache import LRUCache
+from metrics import metrics
+
 
 class Database:
-    def __init__(self, db_path: str = "nco_data.db"):
+    """Хранилище профилей НКО.
+
+    Одно долгоживущее соединение SQLite (WAL) обслуживается выделенным потоком,
+    поэтому запросы не блокируют event loop. Профили кэшируются в памяти
+    (write-through), так что повторные чтения не обращаются к диску.
+    """
+
+    def __init__(self, db_path: str = "nco_data.db", cache_size: int = 10000):
         self.db_path = db_path
+        # Один поток — все обращения к соединению идут последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=128)
+        self._cache = LRUCache(cache_size)
         self.init_db()
 
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS nco_info (
                     user_id INTEGER PRIMARY KEY,
@@ -19,9 +38,33 @@ class Database:
                     website TEXT
                 )
             """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_state (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS attachment_text (
+                    file_unique_id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS attachment_text_created ON attachment_text (created_at)")
 
-    def save_nco_info(self, user_id: int, nco_name: str, activities: str, audience: str, website: str):
-        with sqlite3.connect(self.db_path) as conn:
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        # Вместе с ожиданием очереди потока: запросы к SQLite идут по одному
+        with metrics.timer('db', op=fn.__name__.lstrip('_')):
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    # ── НКО ──────────────────────────────────────────────────────────
+    def _save_nco_info(self, user_id: int, nco_name: str, activities: str, audience: str, website: str):
+        with self._conn as conn:
             conn.execute("""
                 INSERT INTO nco_info (user_id, nco_name, activities, audience, website)
                 VALUES (?, ?, ?, ?, ?)
@@ -32,15 +75,90 @@ class Database:
                     website=excluded.website
             """, (user_id, nco_name, activities, audience, website))
 
-    def get_nco_info(self, user_id: int) -> Optional[dict]:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT nco_name, activities, audience, website FROM nco_info WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'name': row[0] or '',
-                    'activities': row[1] or '',
-                    'audience': row[2] or '',
-                    'website': row[3] or ''
-                }
-        return None
\ No newline at end of file
+    def _get_nco_info(self, user_id: int) -> Optional[dict]:
+        cursor = self._conn.execute("SELECT nco_name, activities, audience, website FROM nco_info WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row:
+            return {
+                'name': row[0] or '',
+                'activities': row[1] or '',
+                'audience': row[2] or '',
+                'website': row[3] or ''
+            }
+        return None
+
+    async def save_nco_info(self, user_id: int, nco_name: str, activities: str, audience: str, website: str):
+        await self._run(self._save_nco_info, user_id, nco_name, activities, audience, website)
+        self._cache.set(user_id, {
+            'name': nco_name or '',
+            'activities': activities or '',
+            'audience': audience or '',
+            'website': website or ''
+        })
+
+    async def get_nco_info(self, user_id: int) -> Optional[dict]:
+        # None тоже кэшируем: у большинства пользователей профиля нет
+        cached = self._cache.get(user_id, default=False)
+        if cached is False:
+            cached = await self._run(self._get_nco_info, user_id)
+            self._cache.set(user_id, cached)
+        return dict(cached) if cached else None
+
+    # ── СОСТОЯНИЕ ДИАЛОГОВ ───────────────────────────────────────────
+    def _load_user_states(self) -> dict[int, str]:
+        return dict(self._conn.execute("SELECT user_id, data FROM user_state"))
+
+    def _save_user_states(self, batch: dict[int, Optional[str]]):
+        with self._conn as conn:
+            conn.executemany(
+                "INSERT INTO user_state (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data=excluded.data",
+                [(uid, data) for uid, data in batch.items() if data is not None]
+            )
+            conn.executemany(
+                "DELETE FROM user_state WHERE user_id = ?",
+                [(uid,) for uid, data in batch.items() if data is None]
+            )
+
+    async def load_user_states(self) -> dict[int, str]:
+        return await self._run(self._load_user_states)
+
+    async def save_user_states(self, batch: dict[int, Optional[str]]):
+        """Сохраняет пачку состояний одной транзакцией; None — удалить запись."""
+        await self._run(self._save_user_states, batch)
+
+    # ── ТЕКСТ ИЗ ВЛОЖЕНИЙ ────────────────────────────────────────────
+    def _get_attachment_text(self, file_unique_id: str, max_age: float) -> Optional[tuple[str, float]]:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT text, created_at FROM attachment_text WHERE file_unique_id = ? AND created_at >= ?",
+            (file_unique_id, now - max_age)
+        ).fetchone()
+        return (row[0], now - row[1]) if row else None
+
+    def _save_attachment_text(self, file_unique_id: str, text: str, max_age: float, max_rows: int):
+        now = time.time()
+        with self._conn as conn:
+            conn.execute(
+                "INSERT INTO attachment_text (file_unique_id, text, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(file_unique_id) DO UPDATE SET text=excluded.text, created_at=excluded.created_at",
+                (file_unique_id, text, now)
+            )
+            # Чистим просроченное и всё, что не влезает в лимит строк
+            conn.execute("DELETE FROM attachment_text WHERE created_at < ?", (now - max_age,))
+            conn.execute("""
+                DELETE FROM attachment_text WHERE file_unique_id IN (
+                    SELECT file_unique_id FROM attachment_text ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (max_rows,))
+
+    async def get_attachment_text(self, file_unique_id: str, max_age: float) -> Optional[tuple[str, float]]:
+        """Текст вложения и его возраст в секундах; None — нет записи или она старше max_age."""
+        return await self._run(self._get_attachment_text, file_unique_id, max_age)
+
+    async def save_attachment_text(self, file_unique_id: str, text: str, max_age: float, max_rows: int):
+        await self._run(self._save_attachment_text, file_unique_id, text, max_age, max_rows)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,138 @@
+# flows.py
+"""Граф диалогов бота: шаги, кнопки, переходы «Назад» и клавиатуры.
+
+Номера шагов сохраняются в БД вместе с состоянием пользователя —
+существующие номера не меняем. Проверка графа без запуска бота:
+
+    python flows.py
+"""
+import sys
+
+from fsm import Dialog, Flow, Machine, MENU, State
+
+
+BACK = "⬅️ Назад"
+SKIP = "⏭️ Пропустить"
+CLEAR = "🧹 Очистить"
+HOME = "🏠 Назад в главное меню"
+
+# ── КЛАВИАТУРЫ ───────────────────────────────────────────────────────
+def main_menu_rows(has_data: bool) -> tuple:
+    return (
+        ("📝 Генерация текста", "🎨 Генерация изображения"),
+        ("✏️ Редактор текста", "📅 Контент-план"),
+        ("👁️ Просмотреть информацию об НКО" if has_data else "➕ Предоставить информацию об НКО",),
+    )
+
+
+BACK_ROWS = ((BACK,),)
+HOME_ROWS = ((HOME,),)
+
+TEXT_MODE_ROWS = (("💬 Свободный текст", "📋 Структурированная форма"), (HOME,))
+POST_TYPE_ROWS = (("📢 Анонс", "📰 Новости"), ("🎯 Призыв к действию", "📊 Отчет"), (BACK,))
+TEXT_STYLE_ROWS = (("💬 Разговорный", "📋 Официально-деловой"), ("🎨 Художественный", "⚪ Без стиля"), (BACK,))
+
+IMAGE_STYLE_ROWS = (("🎨 Реализм", "🖼️ Мультяшный"), ("💧 Акварель", "🤖 Киберпанк"), ("✨ Свой стиль",), (BACK,))
+
+EDIT_ACTION_ROWS = (
+    ("📈 Увеличить текст", "📉 Сократи текст"),
+    ("✅ Исправить ошибки", "🎨 Изменить стиль"),
+    ("🔄 Перефразировать",),
+    (BACK,),
+)
+EDIT_STYLE_ROWS = (("💬 Разговорный", "📋 Официальный"), ("🎨 Художественный", "⚪ Без стиля"), (BACK,))
+
+PERIOD_ROWS = (("📅 Неделя", "📆 Месяц"), ("✏️ Ввести свой период",), (BACK,))
+SKIP_BACK_ROWS = ((SKIP, BACK),)
+FREQ_WEEK_ROWS = (("📅 1 раз в день", "📅 1 раз в неделю"), ("📅 2 раза в неделю", "📅 3 раза в неделю"), (BACK,))
+FREQ_MONTH_ROWS = FREQ_WEEK_ROWS[:2] + (("📅 2 раза в месяц",), (BACK,))
+
+NCO_SKIP_ROWS = ((SKIP,), (HOME,))
+NCO_SKIP_CLEAR_ROWS = ((SKIP, CLEAR), (HOME,))
+
+# ── СТИЛИ ────────────────────────────────────────────────────────────
+TEXT_STYLES = {"💬 Разговорный": "разговорный", "📋 Официально-деловой": "официально-деловой",
+               "🎨 Художественный": "художественный", "⚪ Без стиля": None}
+IMAGE_STYLES = {"🎨 Реализм": "реализм", "🖼️ Мультяшный": "мультяшный",
+                "💧 Акварель": "акварель", "🤖 Киберпанк": "киберпанк"}
+EDIT_STYLES = {"💬 Разговорный": "разговорный", "📋 Официальный": "официальный",
+               "🎨 Художественный": "художественный", "⚪ Без стиля": None}
+PERIODS = {"📅 Неделя": "неделя", "📆 Месяц": "месяц"}
+
+
+# ── РАЗДЕЛЫ ──────────────────────────────────────────────────────────
+NCO_FLOW = Flow('nco', slots=('edit_mode',), states=[
+    State(1, 'nco_name', NCO_SKIP_ROWS, back=MENU, back_text="👤 *Название НКО:*",
+          on_input='save_step'),
+    State(2, 'nco_activities', NCO_SKIP_ROWS, back='nco_name', back_text="📝 *Деятельность НКО:*",
+          prompt="📝 *Деятельность НКО:*\n\nЧем занимается ваша организация? Опишите основные направления работы.",
+          on_input='save_step'),
+    State(3, 'nco_audience', NCO_SKIP_ROWS, back='nco_activities', back_text="🎯 *Целевая аудитория:*",
+          prompt="🎯 *Целевая аудитория:*\n\nДля кого вы работаете? Кто ваши благополучатели, волонтёры, партнёры?",
+          on_input='save_step'),
+    State(4, 'nco_website', NCO_SKIP_ROWS, back='nco_audience',
+          prompt="🌐 *Сайт НКО:*\n\nУкажите адрес сайта (если есть). Можно пропустить.",
+          on_input='save_step'),
+])
+
+TEXT_FLOW = Flow('text', slots=('mode', 'post_type', 'prompt'), states=[
+    State(10, 'text_mode', TEXT_MODE_ROWS, back_text="👌 Хорошо, вернёмся к выбору режима.",
+          buttons={"💬 Свободный текст": 'choose_free', "📋 Структурированная форма": 'choose_structured'}),
+    State(11, 'select_post_type', POST_TYPE_ROWS, back='text_mode',
+          back_text="👌 Хорошо, вернёмся к выбору типа поста.", on_input='set_post_type'),
+    State(12, 'text_prompt', BACK_ROWS, back=('post_type', 'select_post_type', 'text_mode'),
+          back_text="👌 Хорошо, давай перепишем детали поста.\n\nОпиши заново, о чём должен быть текст:",
+          on_input='set_prompt'),
+    State(13, 'select_style', TEXT_STYLE_ROWS, back='text_prompt',
+          buttons=dict.fromkeys(TEXT_STYLES, 'generate')),
+])
+
+IMAGE_FLOW = Flow('image', slots=('prompt',), states=[
+    State(20, 'image_prompt', HOME_ROWS,
+          back_text="👌 Хорошо, давай изменим описание картинки.\n\nОпиши заново, что хочешь увидеть:",
+          on_input='set_prompt'),
+    State(21, 'image_style', IMAGE_STYLE_ROWS, back='image_prompt',
+          back_text="👌 Хорошо, выбирай стиль из предложенных вариантов.",
+          buttons={**dict.fromkeys(IMAGE_STYLES, 'generate'), "✨ Свой стиль": 'choose_custom'}),
+    State(22, 'custom_image_style', BACK_ROWS, back='image_style', on_input='generate_custom'),
+])
+
+EDIT_FLOW = Flow('edit', slots=('text',), states=[
+    State(30, 'edit_text', HOME_ROWS,
+          back_text="👌 Хорошо, пришли новый текст для редактирования или подтверди старый.",
+          on_input='set_text'),
+    State(31, 'edit_action', EDIT_ACTION_ROWS, back='edit_text',
+          back_text="👌 Хорошо, вернёмся к выбору действия.",
+          buttons={"🎨 Изменить стиль": 'choose_style'}, on_input='apply_action'),
+    State(32, 'edit_style', EDIT_STYLE_ROWS, back='edit_action',
+          buttons=dict.fromkeys(EDIT_STYLES, 'apply_style')),
+])
+
+PLAN_FLOW = Flow('plan', slots=('theme', 'period', 'start', 'end'), states=[
+    State(40, 'plan_theme', HOME_ROWS, back_text="👌 Хорошо, вернёмся к теме контент-плана.",
+          on_input='set_theme'),
+    State(41, 'plan_period', PERIOD_ROWS, back='plan_theme',
+          back_text="👌 Хорошо, вернёмся к выбору периода.",
+          buttons={**dict.fromkeys(PERIODS, 'set_period'), "✏️ Ввести свой период": 'choose_custom'}),
+    State(42, 'plan_start', SKIP_BACK_ROWS, back='plan_period',
+          back_text="👌 Хорошо, вернёмся к дате начала.", on_input='set_start'),
+    State(43, 'plan_end', BACK_ROWS, back='plan_start',
+          back_text="👌 Хорошо, вернёмся к дате конца периода.", on_input='set_end'),
+    State(44, 'plan_freq', FREQ_MONTH_ROWS, back=('end', 'plan_end', 'plan_period'), on_input='generate'),
+])
+
+MACHINE = Machine(NCO_FLOW, TEXT_FLOW, IMAGE_FLOW, EDIT_FLOW, PLAN_FLOW)
+
+
+def dialog(user_data: dict) -> Dialog:
+    return Dialog(MACHINE, user_data)
+
+
+if __name__ == "__main__":
+    problems = MACHINE.validate()
+    for flow in MACHINE.flows.values():
+        print(f"{flow.name}: {', '.join(f'{s.id}:{s.name}' for s in flow.states)}")
+    for problem in problems:
+        print(f"  ✗ {problem}")
+    print("Граф в порядке" if not problems else f"Проблем: {len(problems)}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,172 @@
+# fsm.py
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+
+MENU = "menu"   # цель «Назад», ведущая из раздела в главное меню
+
+
+@dataclass
+class State:
+    """Шаг диалога.
+
+    id хранится в user_data и переживает перезапуск, поэтому его нельзя
+    менять у существующих шагов — только добавлять новые.
+
+    back — куда ведёт «⬅️ Назад»: имя шага, MENU или (слот, шаг_если_заполнен, шаг_иначе).
+    back_text — что ответить, вернувшись на этот шаг.
+    buttons — кнопка → имя действия обработчика; on_input — действие для любого другого текста.
+    """
+    id: int
+    name: str
+    keyboard: Optional[tuple] = None
+    back: Union[str, tuple, None] = None
+    back_text: str = ""
+    prompt: str = ""
+    buttons: dict = field(default_factory=dict)
+    on_input: Optional[str] = None
+
+
+@dataclass
+class Flow:
+    name: str
+    slots: tuple
+    states: list
+
+    def __post_init__(self):
+        self.slot_index = {slot: i for i, slot in enumerate(self.slots)}
+
+
+class FlowError(Exception):
+    pass
+
+
+class Machine:
+    """Граф всех диалогов, собранный в таблицы переходов при импорте."""
+
+    def __init__(self, *flows: Flow):
+        self.flows: dict[str, Flow] = {}
+        self.states: dict[int, State] = {}
+        self.by_name: dict[str, State] = {}
+        self.flow_of: dict[int, Flow] = {}
+        # (id шага, текст) → имя действия; текст None — действие для произвольного ввода
+        self.transitions: dict[tuple, str] = {}
+        for flow in flows:
+            self.add(flow)
+
+    def add(self, flow: Flow):
+        if flow.name in self.flows:
+            raise FlowError(f"Раздел {flow.name} объявлен дважды")
+        self.flows[flow.name] = flow
+        for state in flow.states:
+            if state.id in self.states or state.name in self.by_name:
+                raise FlowError(f"Шаг {state.id} {state.name} объявлен дважды")
+            self.states[state.id] = state
+            self.by_name[state.name] = state
+            self.flow_of[state.id] = flow
+            for button, action in state.buttons.items():
+                self.transitions[(state.id, button)] = action
+            if state.on_input:
+                self.transitions[(state.id, None)] = state.on_input
+
+    def back_target(self, state: State, slots: list) -> Union[State, str, None]:
+        back = state.back
+        if isinstance(back, tuple):
+            slot, if_set, otherwise = back
+            index = self.flow_of[state.id].slot_index[slot]
+            back = if_set if index < len(slots) and slots[index] is not None else otherwise
+        if back is None or back == MENU:
+            return back
+        return self.by_name[back]
+
+    def validate(self) -> list[str]:
+        """Проверяет граф целиком; возвращает список проблем (пустой — всё в порядке)."""
+        problems = []
+        for state in self.states.values():
+            flow = self.flow_of[state.id]
+            back = state.back
+            targets = [back[1], back[2]] if isinstance(back, tuple) else [back]
+            if isinstance(back, tuple) and back[0] not in flow.slot_index:
+                problems.append(f"{state.name}: «Назад» зависит от неизвестного слота {back[0]}")
+            for target in targets:
+                if target is None or target == MENU:
+                    continue
+                if target not in self.by_name:
+                    problems.append(f"{state.name}: «Назад» ведёт в несуществующий шаг {target}")
+                elif self.flow_of[self.by_name[target].id] is not flow:
+                    problems.append(f"{state.name}: «Назад» ведёт в другой раздел ({target})")
+                elif not self.by_name[target].back_text:
+                    problems.append(f"{target}: нет текста для возврата с шага {state.name}")
+            if state.keyboard:
+                labels = {label for row in state.keyboard for label in row}
+                for button in state.buttons:
+                    if button not in labels:
+                        problems.append(f"{state.name}: кнопки «{button}» нет на клавиатуре шага")
+            if not state.buttons and not state.on_input and state.back is None:
+                problems.append(f"{state.name}: из шага нет переходов")
+        return problems
+
+
+class Dialog:
+    """Состояние диалога пользователя внутри context.user_data.
+
+    Хранится компактно: user_data['state'] — номер шага,
+    user_data['slots'] — список значений слотов текущего раздела.
+    """
+
+    __slots__ = ("machine", "data")
+
+    def __init__(self, machine: Machine, data: dict):
+        self.machine = machine
+        self.data = data
+
+    @property
+    def state(self) -> Optional[State]:
+        return self.machine.states.get(self.data.get('state'))
+
+    @property
+    def name(self) -> Optional[str]:
+        state = self.state
+        return state.name if state else None
+
+    @property
+    def flow(self) -> Optional[str]:
+        flow = self.machine.flow_of.get(self.data.get('state'))
+        return flow.name if flow else None
+
+    @property
+    def slots(self) -> list:
+        return self.data.get('slots') or []
+
+    def go(self, name: str, **slots):
+        """Переходит на шаг; при смене раздела слоты обнуляются."""
+        state = self.machine.by_name[name]
+        flow = self.machine.flow_of[state.id]
+        if self.machine.flow_of.get(self.data.get('state')) is not flow:
+            self.data['slots'] = [None] * len(flow.slots)
+        self.data['state'] = state.id
+        for slot, value in slots.items():
+            self.set(slot, value)
+
+    def start(self, name: str, **slots):
+        """Начинает раздел с шага name с чистыми слотами."""
+        self.reset()
+        self.go(name, **slots)
+
+    def get(self, slot: str, default=None):
+        flow = self.machine.flow_of.get(self.data.get('state'))
+        if flow is None or slot not in flow.slot_index:
+            return default
+        slots = self.slots
+        index = flow.slot_index[slot]
+        value = slots[index] if index < len(slots) else None
+        return default if value is None else value
+
+    def set(self, slot: str, value):
+        flow = self.machine.flow_of[self.data['state']]
+        slots = self.data.setdefault('slots', [None] * len(flow.slots))
+        slots[flow.slot_index[slot]] = value
+
+    def reset(self):
+        self.data.pop('state', None)
+        self.data.pop('slots', None)
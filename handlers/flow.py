@@ -0,0 +1,82 @@
+# handlers/flow.py
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from flows import BACK, MACHINE, dialog
+from fsm import Dialog, MENU, State
+from text_service import GenerationThrottled
+from .keyboards import KEYBOARDS, reply_keyboard
+from .streaming import finish_stream
+
+
+class FlowHandler:
+    """Обработчик раздела, шаги которого описаны в flows.py.
+
+    Действия из графа привязываются к методам один раз при создании,
+    дальше выбор действия — один поиск в dict по (шаг, текст).
+    Методы-действия вызываются как action(update, context, dialog, text, nco_info, **kw).
+    Действия из ai_actions запускают генерацию: пока пользователь ждёт после
+    отказа планировщика, они сразу отвечают, через сколько можно повторить.
+    """
+
+    flow: str = ""
+    ai_actions: tuple = ()
+
+    def __init__(self, limiter=None):
+        self.limiter = limiter
+        self._actions = {}
+        self._keyboards = {}
+        for state in MACHINE.flows[self.flow].states:
+            if state.keyboard:
+                self._keyboards[state.id] = reply_keyboard(state.keyboard)
+            for button in list(state.buttons) + [None]:
+                action = MACHINE.transitions.get((state.id, button))
+                if action:
+                    self._actions[(state.id, button)] = getattr(self, action)
+
+    def keyboard_for(self, state: State, d: Dialog):
+        return self._keyboards.get(state.id)
+
+    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, nco_info: dict = None, **kw):
+        d = dialog(context.user_data)
+        state = d.state
+        if state is None or text is None:
+            return False
+        if text == BACK and state.back is not None:
+            await self.back(update, context, d, **kw)
+            return True
+        action = self._actions.get((state.id, text)) or self._actions.get((state.id, None))
+        if action is not None:
+            if action.__name__ in self.ai_actions and await self._refuse_throttled(update, d, **kw):
+                return True
+            await action(update, context, d, text, nco_info, **kw)
+        return True
+
+    async def _refuse_throttled(self, update: Update, d: Dialog, **kw) -> bool:
+        if self.limiter is None or update.effective_user is None:
+            return False
+        wait = self.limiter.retry_after(update.effective_user.id)
+        if wait <= 0:
+            return False
+        await self.generation_failed(update, d, GenerationThrottled(wait), **kw)
+        return True
+
+    async def back(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, **kw):
+        target = MACHINE.back_target(d.state, d.slots)
+        if target == MENU:
+            await self.exit(update, context, **kw)
+            return
+        d.go(target.name)
+        await update.message.reply_text(target.back_text, reply_markup=self.keyboard_for(target, d), parse_mode='Markdown', **kw)
+
+    async def exit(self, update: Update, context: ContextTypes.DEFAULT_TYPE, **kw):
+        context.user_data.clear()
+        await update.message.reply_text("👌 Возврат в главное меню.", reply_markup=KEYBOARDS.main(True), **kw)
+
+    async def generation_failed(self, update: Update, d: Dialog, error: Exception, status=None, **kw):
+        """Модель не ответила. Шаг не меняем — тот же вариант можно просто выбрать ещё раз."""
+        if status is not None:
+            await finish_stream(status, f"😕 {error}", parse_mode=None)
+            await update.message.reply_text("Выбери вариант ещё раз 👇", reply_markup=self.keyboard_for(d.state, d), **kw)
+            return
+        await update.message.reply_text(f"😕 {error}", reply_markup=self.keyboard_for(d.state, d), **kw)
@@ -1,23 +1,67 @@
 # handlers/handlers_image.py
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
 
-style_kb = ReplyKeyboardMarkup([
-    ["🎨 Реализм", "🖼️ Мультяшный"],
-    ["💧 Акварель", "🤖 Киберпанк"],
-    ["✨ Свой стиль"],
-    ["⬅️ Назад"]
-], resize_keyboard=True)
+from flows import BACK_ROWS, HOME_ROWS, IMAGE_STYLE_ROWS, IMAGE_STYLES, dialog
+from fsm import Dialog
+from jobs import CANCEL_PREFIX, ImageJob, QueueFull
+from .flow import FlowHandler
+from .keyboards import reply_keyboard
 
-BACK_TO_MAIN = ReplyKeyboardMarkup([["🏠 Назад в главное меню"]], resize_keyboard=True)
+style_kb = reply_keyboard(IMAGE_STYLE_ROWS)
 
+BACK_TO_MAIN = reply_keyboard(HOME_ROWS)
+BACK_SIMPLE = reply_keyboard(BACK_ROWS)
 
-class ImageHandler:
-    def __init__(self, image_service):
+
+class ImageHandler(FlowHandler):
+    flow = 'image'
+    ai_actions = ('generate', 'generate_custom')
+
+    def __init__(self, image_service, jobs):
+        super().__init__(image_service.limiter)
         self.isvc = image_service
+        self.jobs = jobs
+
+    async def _submit(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, nco_info: dict, style: str,
+                      caption: str, fail_text: str, **kw):
+        # Генерация идёт в фоне: воркер сам пришлёт картинку, а пользователь свободен
+        from .handlers_nco import get_main_keyboard
+        job = ImageJob(
+            user_id=update.effective_user.id,
+            chat_id=update.effective_chat.id,
+            prompt=d.get('prompt'),
+            nco_info=nco_info,
+            style=style,
+            caption=caption,
+            fail_text=fail_text,
+            reply_to_message_id=kw.get('reply_to_message_id'),
+            reply_markup=get_main_keyboard(True)
+        )
+        context.user_data.clear()
+        try:
+            await self.jobs.submit(job)
+        except QueueFull:
+            await update.message.reply_text(
+                "😕 Сейчас рисуется слишком много картинок. Дождись готовых и попробуй ещё раз!",
+                reply_markup=get_main_keyboard(True), **kw
+            )
+            return
+        await update.message.reply_text(
+            "👌 Пока картинка готовится, можно пользоваться ботом.",
+            reply_markup=get_main_keyboard(True), **kw
+        )
+
+    async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        job_id = query.data[len(CANCEL_PREFIX):]
+        if job_id.isdigit() and await self.jobs.cancel(int(job_id), query.from_user.id):
+            await query.answer("Генерация отменена")
+        else:
+            await query.answer("Эту картинку уже не отменить")
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, **kw):
-        context.user_data['waiting'] = 'image_prompt'
+        dialog(context.user_data).start('image_prompt')
         await update.message.reply_text(
             "🎨 Отлично! Давай создадим крутую картинку для твоего поста!\n\n"
             "Опиши, что хочешь увидеть — представь это в деталях.\n"
@@ -28,110 +72,53 @@ class ImageHandler:
             **kw
         )
 
-    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, nco_info: dict, **kw):
-        w = context.user_data.get('waiting')
-
-        # 1. Описание (первый шаг)
-        if w == 'image_prompt':
-            if text == "🏠 Назад в главное меню":
-                context.user_data.clear()
-                from .handlers_nco import get_main_keyboard
-                await update.message.reply_text(
-                    "👌 Хорошо, возвращаемся в главное меню. Если захочешь создать картинку — просто скажи!",
-                    reply_markup=get_main_keyboard(True), **kw
-                )
-                return True
-
-            context.user_data['image_prompt'] = text
-            context.user_data['waiting'] = 'image_style'
-            await update.message.reply_text(
-                f"✨ Отлично! Запомнил твоё описание: *{text[:50]}...*\n\n"
-                "Теперь давай выберем стиль — от этого зависит настроение картинки!\n\n"
-                "🎯 *Примеры стилей:*\n"
-                "• «🎨 Реализм» — как живая фотография\n"  
-                "• «🖼️ Мультяшный» — ярко и весело\n"
-                "• «💧 Акварель» — нежно и творчески\n"
-                "• «🤖 Киберпанк» — футуристично и смело",
-                reply_markup=style_kb,
-                parse_mode='Markdown',
-                **kw
-            )
-            return True
-
-        # 2. Стиль
-        if w == 'image_style':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'image_prompt'
-                await update.message.reply_text(
-                    "👌 Хорошо, давай изменим описание картинки.\n\n"
-                    "Опиши заново, что хочешь увидеть:",
-                    reply_markup=BACK_TO_MAIN,
-                    parse_mode='Markdown',
-                    **kw
-                )
-                return True
-
-            styles = {
-                "🎨 Реализм": "реализм", "🖼️ Мультяшный": "мультяшный",
-                "💧 Акварель": "акварель", "🤖 Киберпанк": "киберпанк"
-            }
-
-            if text in styles:
-                await update.message.reply_text("🎨 Генерирую картинку... Обычно это занимает не больше минуты! ⏳", **kw)
-                img = await self.isvc.generate_image(context.user_data['image_prompt'], nco_info, styles[text])
-                from .handlers_nco import get_main_keyboard
-                if img:
-                    await update.message.reply_photo(
-                        photo=img,
-                        caption="✅ Готово! Нравится результат?\n\n"
-                               "Если хочешь что-то изменить — попробуй другой стиль или уточни описание!",
-                        reply_markup=get_main_keyboard(True), **kw
-                    )
-                else:
-                    await update.message.reply_text(
-                        "😕 Упс, что-то пошло не так... Давай попробуем ещё раз?",
-                        reply_markup=get_main_keyboard(True), **kw
-                    )
-                context.user_data.clear()
-            elif text == "✨ Свой стиль":
-                context.user_data['waiting'] = 'custom_image_style'
-                await update.message.reply_text(
-                    "🎨 Круто! Творческий подход — это здорово!\n\n"
-                    "Опиши свой стиль словами — я постараюсь его воссоздать.\n\n"
-                    "✨ *Примеры:*\n"
-                    "• «В стиле поп-арт как у Энди Уорхола»\n"
-                    "• «Ретро-футуризм 80-х»\n"
-                    "• «Как акварельный скетч с лёгкой небрежностью»\n\n"
-                    "Какой стиль ты представляешь?",
-                    reply_markup=ReplyKeyboardMarkup([["⬅️ Назад"]], resize_keyboard=True),
-                    parse_mode='Markdown',
-                    **kw
-                )
-            return True
+    # 1. Описание
+    async def set_prompt(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('image_style', prompt=text)
+        await update.message.reply_text(
+            f"✨ Отлично! Запомнил твоё описание: *{text[:50]}...*\n\n"
+            "Теперь давай выберем стиль — от этого зависит настроение картинки!\n\n"
+            "🎯 *Примеры стилей:*\n"
+            "• «🎨 Реализм» — как живая фотография\n"
+            "• «🖼️ Мультяшный» — ярко и весело\n"
+            "• «💧 Акварель» — нежно и творчески\n"
+            "• «🤖 Киберпанк» — футуристично и смело",
+            reply_markup=style_kb,
+            parse_mode='Markdown',
+            **kw
+        )
 
-        # 3. Свой стиль
-        if w == 'custom_image_style':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'image_style'
-                await update.message.reply_text("👌 Хорошо, выбирай стиль из предложенных вариантов.", reply_markup=style_kb, parse_mode='Markdown', **kw)
-                return True
+    # 2. Стиль
+    async def generate(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        await self._submit(
+            update, context, d, nco_info, IMAGE_STYLES[text],
+            caption="✅ Готово! Нравится результат?\n\n"
+                    "Если хочешь что-то изменить — попробуй другой стиль или уточни описание!",
+            fail_text="😕 Упс, что-то пошло не так... Давай попробуем ещё раз?",
+            **kw
+        )
 
-            await update.message.reply_text("🎨 Генерирую с твоим уникальным стилем... Жди волшебства! ✨", **kw)
-            img = await self.isvc.generate_image(context.user_data['image_prompt'], nco_info, text)
-            from .handlers_nco import get_main_keyboard
-            if img:
-                await update.message.reply_photo(
-                    photo=img,
-                    caption="✅ Вот что получилось с твоим стилем! Нравится?\n\n"
-                           "Если хочешь что-то изменить — просто начни заново и опиши по-другому!",
-                    reply_markup=get_main_keyboard(True), **kw
-                )
-            else:
-                await update.message.reply_text(
-                    "😕 Не получилось создать картинку с таким стилем... Может, попробуем другой вариант?",
-                    reply_markup=get_main_keyboard(True), **kw
-                )
-            context.user_data.clear()
-            return True
+    async def choose_custom(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('custom_image_style')
+        await update.message.reply_text(
+            "🎨 Круто! Творческий подход — это здорово!\n\n"
+            "Опиши свой стиль словами — я постараюсь его воссоздать.\n\n"
+            "✨ *Примеры:*\n"
+            "• «В стиле поп-арт как у Энди Уорхола»\n"
+            "• «Ретро-футуризм 80-х»\n"
+            "• «Как акварельный скетч с лёгкой небрежностью»\n\n"
+            "Какой стиль ты представляешь?",
+            reply_markup=BACK_SIMPLE,
+            parse_mode='Markdown',
+            **kw
+        )
 
-        return False
+    # 3. Свой стиль
+    async def generate_custom(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        await self._submit(
+            update, context, d, nco_info, text,
+            caption="✅ Вот что получилось с твоим стилем! Нравится?\n\n"
+                    "Если хочешь что-то изменить — просто начни заново и опиши по-другому!",
+            fail_text="😕 Не получилось создать картинку с таким стилем... Может, попробуем другой вариант?",
+            **kw
+        )
@@ -1,39 +1,50 @@
 # handlers/handlers_plan.py
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from flows import (
+    BACK_ROWS, FREQ_MONTH_ROWS, FREQ_WEEK_ROWS, HOME_ROWS, PERIOD_ROWS, PERIODS, SKIP, SKIP_BACK_ROWS, dialog
+)
+from fsm import Dialog, State
+from text_service import GenerationError
+from .flow import FlowHandler
+from .keyboards import reply_keyboard
+from .streaming import stream_to_message, finish_stream
 
 # === Клавиатуры ===
-period_kb = ReplyKeyboardMarkup([
-    ["📅 Неделя", "📆 Месяц"],
-    ["✏️ Ввести свой период"],
-    ["⬅️ Назад"]
-], resize_keyboard=True)
+period_kb = reply_keyboard(PERIOD_ROWS)
 
 # Частота для недели — сетка 2×2
-freq_week = ReplyKeyboardMarkup([
-    ["📅 1 раз в день", "📅 1 раз в неделю"],
-    ["📅 2 раза в неделю", "📅 3 раза в неделю"],
-    ["⬅️ Назад"]
-], resize_keyboard=True)
+freq_week = reply_keyboard(FREQ_WEEK_ROWS)
 
 # Частота для месяца
-freq_month = ReplyKeyboardMarkup([
-    ["📅 1 раз в день", "📅 1 раз в неделю"],
-    ["📅 2 раза в неделю", "📅 3 раза в неделю"],
-    ["📅 2 раза в месяц"],
-    ["⬅️ Назад"]
-], resize_keyboard=True)
+freq_month = reply_keyboard(FREQ_MONTH_ROWS)
+
+BACK_TO_MAIN = reply_keyboard(HOME_ROWS)
+BACK_SIMPLE = reply_keyboard(BACK_ROWS)
+SKIP_BACK = reply_keyboard(SKIP_BACK_ROWS)
 
-BACK_TO_MAIN = ReplyKeyboardMarkup([["🏠 Назад в главное меню"]], resize_keyboard=True)
 
+class PlanHandler(FlowHandler):
+    flow = 'plan'
+    ai_actions = ('generate',)
 
-class PlanHandler:
     def __init__(self, text_service):
+        super().__init__(text_service.limiter)
         self.ts = text_service
 
+    def keyboard_for(self, state: State, d: Dialog):
+        # Сетка частот зависит от длины периода
+        if state.name == 'plan_freq':
+            period = d.get('period')
+            if period == 'неделя' or (period == 'custom' and (d.get('end') - d.get('start')).days <= 7):
+                return freq_week
+            return freq_month
+        return super().keyboard_for(state, d)
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, **kw):
-        context.user_data['waiting'] = 'plan_theme'
+        dialog(context.user_data).start('plan_theme')
         await update.message.reply_text(
             "📅 *Отлично! Давай составим контент-план!*\n\n"
             "Сначала напиши *тему*, которая тебя интересует.\n\n"
@@ -48,130 +59,96 @@ class PlanHandler:
             **kw
         )
 
-    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, nco_info: dict, **kw):
-        w = context.user_data.get('waiting')
-
-        # === Тема ===
-        if w == 'plan_theme':
-            if text == "🏠 Назад в главное меню":
-                context.user_data.clear()
-                from .handlers_nco import get_main_keyboard
-                await update.message.reply_text("👌 Хорошо, возвращаемся в главное меню. Если понадобится контент-план — просто скажи!", reply_markup=get_main_keyboard(True), **kw)
-                return True
-            context.user_data['plan_theme'] = text
-            context.user_data['waiting'] = 'plan_period'
-            await update.message.reply_text(
-                f"✨ Отлично! Тема: *{text}*\n\n"
-                "Теперь выбери *период*, на который нужен контент-план:",
-                reply_markup=period_kb,
-                parse_mode='Markdown',
-                **kw
-            )
-            return True
-
-        # === Период ===
-        if w == 'plan_period':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'plan_theme'
-                await update.message.reply_text("👌 Хорошо, вернёмся к теме контент-плана.", reply_markup=BACK_TO_MAIN, parse_mode='Markdown', **kw)
-                return True
-
-            periods = {"📅 Неделя": "неделя", "📆 Месяц": "месяц"}
-            if text in periods:
-                context.user_data.update({'plan_period': periods[text], 'waiting': 'plan_freq'})
-                kb = freq_week if text == "📅 Неделя" else freq_month
-                await update.message.reply_text(
-                    f"📅 Период: *{text}*\n\n"
-                    "Теперь выбери *частоту публикаций* — как часто ты хочешь публиковать посты:",
-                    reply_markup=kb,
-                    parse_mode='Markdown',
-                    **kw
-                )
-            elif text == "✏️ Ввести свой период":
-                context.user_data['waiting'] = 'plan_start'
-                await update.message.reply_text(
-                    "📅 Отлично! Введи *начало* периода в формате ДД.ММ.ГГГГ\n\n"
-                    "✨ *Пример:* 01.12.2025\n\n"
-                    "Или нажми «⏭️ Пропустить», чтобы начать с сегодняшнего дня.",
-                    reply_markup=ReplyKeyboardMarkup([["⏭️ Пропустить", "⬅️ Назад"]], resize_keyboard=True),
-                    parse_mode='Markdown',
-                    **kw
-                )
-            return True
-
-        # === Начало (custom) ===
-        if w == 'plan_start':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'plan_period'
-                await update.message.reply_text("👌 Хорошо, вернёмся к выбору периода.", reply_markup=period_kb, parse_mode='Markdown', **kw)
-                return True
-
-            start = datetime.now().date() if text == "⏭️ Пропустить" else datetime.strptime(text, "%d.%m.%Y").date()
-            context.user_data.update({'plan_start': start, 'waiting': 'plan_end'})
+    # === Тема ===
+    async def set_theme(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('plan_period', theme=text)
+        await update.message.reply_text(
+            f"✨ Отлично! Тема: *{text}*\n\n"
+            "Теперь выбери *период*, на который нужен контент-план:",
+            reply_markup=period_kb,
+            parse_mode='Markdown',
+            **kw
+        )
+
+    # === Период ===
+    async def set_period(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('plan_freq', period=PERIODS[text], start=None, end=None)
+        kb = freq_week if text == "📅 Неделя" else freq_month
+        await update.message.reply_text(
+            f"📅 Период: *{text}*\n\n"
+            "Теперь выбери *частоту публикаций* — как часто ты хочешь публиковать посты:",
+            reply_markup=kb,
+            parse_mode='Markdown',
+            **kw
+        )
+
+    async def choose_custom(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('plan_start')
+        await update.message.reply_text(
+            "📅 Отлично! Введи *начало* периода в формате ДД.ММ.ГГГГ\n\n"
+            "✨ *Пример:* 01.12.2025\n\n"
+            "Или нажми «⏭️ Пропустить», чтобы начать с сегодняшнего дня.",
+            reply_markup=SKIP_BACK,
+            parse_mode='Markdown',
+            **kw
+        )
+
+    # === Начало (custom) ===
+    async def set_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        try:
+            start = datetime.now().date() if text == SKIP else datetime.strptime(text, "%d.%m.%Y").date()
+        except ValueError:
+            await update.message.reply_text("❌ Не получилось разобрать дату.\n\n✨ Пример правильного формата: 01.12.2025", **kw)
+            return
+        d.go('plan_end', start=start)
+        await update.message.reply_text(
+            f"✅ Начало: *{start.strftime('%d.%m.%Y')}*\n\n"
+            "Теперь введи *конец* периода в формате ДД.ММ.ГГГГ\n\n"
+            "✨ *Пример:* 30.12.2025",
+            reply_markup=BACK_SIMPLE,
+            parse_mode='Markdown',
+            **kw
+        )
+
+    # === Конец (custom) ===
+    async def set_end(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        try:
+            end = datetime.strptime(text, "%d.%m.%Y").date()
+            if end <= d.get('start'):
+                raise ValueError("❌ Конец периода должен быть после начала.")
+            days = (end - d.get('start')).days
+            d.go('plan_freq', end=end, period='custom')
+            kb = freq_week if days <= 7 else freq_month
             await update.message.reply_text(
-                f"✅ Начало: *{start.strftime('%d.%m.%Y')}*\n\n"
-                "Теперь введи *конец* периода в формате ДД.ММ.ГГГГ\n\n"
-                "✨ *Пример:* 30.12.2025",
-                reply_markup=ReplyKeyboardMarkup([["⬅️ Назад"]], resize_keyboard=True),
+                f"✅ Конец: *{end.strftime('%d.%m.%Y')}*\n\n"
+                "Теперь выбери *частоту публикаций*:",
+                reply_markup=kb,
                 parse_mode='Markdown',
                 **kw
             )
-            return True
-
-        # === Конец (custom) ===
-        if w == 'plan_end':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'plan_start'
-                await update.message.reply_text("👌 Хорошо, вернёмся к дате начала.", reply_markup=ReplyKeyboardMarkup([["⏭️ Пропустить", "⬅️ Назад"]], resize_keyboard=True), parse_mode='Markdown', **kw)
-                return True
-
-            try:
-                end = datetime.strptime(text, "%d.%m.%Y").date()
-                if end <= context.user_data['plan_start']:
-                    raise ValueError("❌ Конец периода должен быть после начала.")
-                days = (end - context.user_data['plan_start']).days
-                context.user_data.update({'plan_end': end, 'plan_period': 'custom', 'waiting': 'plan_freq'})
-                kb = freq_week if days <= 7 else freq_month
-                await update.message.reply_text(
-                    f"✅ Конец: *{end.strftime('%d.%m.%Y')}*\n\n"
-                    "Теперь выбери *частоту публикаций*:",
-                    reply_markup=kb,
-                    parse_mode='Markdown',
-                    **kw
-                )
-            except ValueError as e:
-                await update.message.reply_text(f"❌ {str(e)}\n\n✨ Пример правильного формата: 30.11.2025", **kw)
-            return True
-
-        # === Частота ===
-        if w == 'plan_freq':
-            if text == "⬅️ Назад":
-                period = context.user_data.get('plan_period')
-                if period == 'custom':
-                    context.user_data['waiting'] = 'plan_end'
-                    await update.message.reply_text("👌 Хорошо, вернёмся к дате конца периода.", reply_markup=ReplyKeyboardMarkup([["⬅️ Назад"]], resize_keyboard=True), parse_mode='Markdown', **kw)
-                else:
-                    context.user_data['waiting'] = 'plan_period'
-                    await update.message.reply_text("👌 Хорошо, вернёмся к выбору периода.", reply_markup=period_kb, parse_mode='Markdown', **kw)
-                return True
-
-            # Генерация плана
-            await update.message.reply_text("📝 Составляю контент-план... Это займёт немного времени! ⏳", **kw)
-            period = context.user_data['plan_period']
-            start = datetime.now().date() if period != 'custom' else context.user_data['plan_start']
-            end = None if period != 'custom' else context.user_data['plan_end']
-            plan = self.ts.generate_content_plan(
-                period, text, nco_info, start, end, context.user_data['plan_theme']
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {str(e)}\n\n✨ Пример правильного формата: 30.11.2025", **kw)
+
+    # === Частота ===
+    async def generate(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        status = await update.message.reply_text("📝 Составляю контент-план... Это займёт немного времени! ⏳", **kw)
+        period = d.get('period')
+        start = datetime.now().date() if period != 'custom' else d.get('start')
+        end = None if period != 'custom' else d.get('end')
+        try:
+            plan = await stream_to_message(
+                status,
+                self.ts.stream_content_plan(period, text, nco_info, start, end, d.get('theme')),
+                header="📝 Составляю контент-план...\n\n"
             )
-            from .handlers_nco import get_main_keyboard
-            await update.message.reply_text(
-                f"✅ *Готово! Вот твой контент-план:*\n\n{plan}\n\n"
-                "💡 Если нужно что-то изменить — просто начни заново или используй редактор текста!",
-                reply_markup=get_main_keyboard(True),
-                parse_mode='Markdown',
-                **kw
-            )
-            context.user_data.clear()
-            return True
-
-        return False
+        except GenerationError as e:
+            await self.generation_failed(update, d, e, status, **kw)
+            return
+        await finish_stream(status, f"✅ *Готово! Вот твой контент-план:*\n\n{plan}")
+        from .handlers_nco import get_main_keyboard
+        await update.message.reply_text(
+            "💡 Если нужно что-то изменить — просто начни заново или используй редактор текста!",
+            reply_markup=get_main_keyboard(True),
+            **kw
+        )
+        context.user_data.clear()
@@ -1,29 +1,39 @@
 # handlers/handlers_text_edit.py
-from telegram import Update, ReplyKeyboardMarkup
+import hashlib
+from typing import Optional
+
+from telegram import Update
 from telegram.ext import ContextTypes
 
-action_kb = ReplyKeyboardMarkup([
-    ["📈 Увеличить текст", "📉 Сократи текст"],
-    ["✅ Исправить ошибки", "🎨 Изменить стиль"],
-    ["🔄 Перефразировать"],
-    ["⬅️ Назад"]
-], resize_keyboard=True)
+from flows import EDIT_ACTION_ROWS, EDIT_STYLE_ROWS, EDIT_STYLES, HOME_ROWS, dialog
+from fsm import Dialog
+from text_service import GenerationError
+from .flow import FlowHandler
+from .keyboards import reply_keyboard
+
+action_kb = reply_keyboard(EDIT_ACTION_ROWS)
+style_kb = reply_keyboard(EDIT_STYLE_ROWS)
+
+BACK_TO_MAIN = reply_keyboard(HOME_ROWS)
+
+# Отпечаток последней выполненной правки — переживает clear() после ответа
+LAST_EDIT_KEY = 'last_edit'
 
-style_kb = ReplyKeyboardMarkup([
-    ["💬 Разговорный", "📋 Официальный"],
-    ["🎨 Художественный", "⚪ Без стиля"],
-    ["⬅️ Назад"]
-], resize_keyboard=True)
 
-BACK_TO_MAIN = ReplyKeyboardMarkup([["🏠 Назад в главное меню"]], resize_keyboard=True)
+def edit_fingerprint(text: str, action: str, style: Optional[str] = None) -> str:
+    return hashlib.sha1(f"{text}\0{action}\0{style or ''}".encode("utf-8")).hexdigest()[:16]
 
 
-class TextEditHandler:
+class TextEditHandler(FlowHandler):
+    flow = 'edit'
+    ai_actions = ('apply_action', 'apply_style')
+
     def __init__(self, text_service):
+        super().__init__(text_service.limiter)
         self.ts = text_service
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, **kw):
-        context.user_data['waiting'] = 'edit_text'
+        dialog(context.user_data).start('edit_text')
         await update.message.reply_text(
             "✍️ *Отлично! Давай отредактируем текст!*\n\n"
             "Пришли текст, который хочешь улучшить.\n\n"
@@ -34,56 +44,40 @@ class TextEditHandler:
             **kw
         )
 
-    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, nco_info: dict, **kw):
-        w = context.user_data.get('waiting')
-
-        if w == 'edit_text':
-            if text == "🏠 Назад в главное меню":
-                context.user_data.clear()
-                from .handlers_nco import get_main_keyboard
-                await update.message.reply_text("👌 Хорошо, возвращаемся в главное меню. Если текст нужно доработать — просто пришли!", reply_markup=get_main_keyboard(True), **kw)
-                return True
-
-            context.user_data['edit_text'] = text
-            context.user_data['waiting'] = 'edit_action'
-            await update.message.reply_text(
-                f"✅ Текст сохранён: *{text[:50]}...*\n\n"
-                "Что сделать с текстом? Выбери действие:",
-                reply_markup=action_kb,
-                parse_mode='Markdown',
-                **kw
-            )
-            return True
-
-        if w == 'edit_action':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'edit_text'
-                await update.message.reply_text("👌 Хорошо, пришли новый текст для редактирования или подтверди старый.", reply_markup=BACK_TO_MAIN, parse_mode='Markdown', **kw)
-                return True
-
-            if text == "🎨 Изменить стиль":
-                context.user_data['waiting'] = 'edit_style'
-                await update.message.reply_text("🎨 Выбери новый стиль для текста:", reply_markup=style_kb, parse_mode='Markdown', **kw)
-            else:
-                await update.message.reply_text("✍️ Редактирую... Секунду! ⏳", **kw)
-                result = self.ts.edit_text_with_action(context.user_data['edit_text'], text, nco_info)
-                from .handlers_nco import get_main_keyboard
-                await update.message.reply_text(f"✅ *Готово!*\n\n{result}", reply_markup=get_main_keyboard(True), parse_mode='Markdown', **kw)
-                context.user_data.clear()
-            return True
-
-        if w == 'edit_style':
-            if text == "⬅️ Назад":
-                context.user_data['waiting'] = 'edit_action'
-                await update.message.reply_text("👌 Хорошо, вернёмся к выбору действия.", reply_markup=action_kb, parse_mode='Markdown', **kw)
-                return True
-
-            styles = {"💬 Разговорный": "разговорный", "📋 Официальный": "официальный", "🎨 Художественный": "художественный", "⚪ Без стиля": None}
-            if text in styles:
-                await update.message.reply_text("🎨 Меняю стиль... ⏳", **kw)
-                result = self.ts.edit_text_with_action(context.user_data['edit_text'], "Изменить стиль", nco_info, styles[text])
-                from .handlers_nco import get_main_keyboard
-                await update.message.reply_text(f"✅ *Готово!*\n\n{result}", reply_markup=get_main_keyboard(True), parse_mode='Markdown', **kw)
-                context.user_data.clear()
-            return True
-        return False
+    async def set_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('edit_action', text=text)
+        await update.message.reply_text(
+            f"✅ Текст сохранён: *{text[:50]}...*\n\n"
+            "Что сделать с текстом? Выбери действие:",
+            reply_markup=action_kb,
+            parse_mode='Markdown',
+            **kw
+        )
+
+    async def choose_style(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        d.go('edit_style')
+        await update.message.reply_text("🎨 Выбери новый стиль для текста:", reply_markup=style_kb, parse_mode='Markdown', **kw)
+
+    async def apply_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        await update.message.reply_text("✍️ Редактирую... Секунду! ⏳", **kw)
+        await self._edit(update, context, d, text, None, nco_info, **kw)
+
+    async def apply_style(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, text: str, nco_info: dict, **kw):
+        await update.message.reply_text("🎨 Меняю стиль... ⏳", **kw)
+        await self._edit(update, context, d, "Изменить стиль", EDIT_STYLES[text], nco_info, **kw)
+
+    async def _edit(self, update: Update, context: ContextTypes.DEFAULT_TYPE, d: Dialog, action: str, style: Optional[str],
+                    nco_info: dict, **kw):
+        source = d.get('text')
+        fingerprint = edit_fingerprint(source, action, style)
+        # Тот же текст с той же кнопкой сразу после ответа — просьба о новом варианте, кэш не берём
+        use_cache = context.user_data.get(LAST_EDIT_KEY) != fingerprint
+        try:
+            result = await self.ts.edit_text_with_action(source, action, nco_info, style, use_cache=use_cache)
+        except GenerationError as e:
+            await self.generation_failed(update, d, e, **kw)
+            return
+        from .handlers_nco import get_main_keyboard
+        await update.message.reply_text(f"✅ *Готово!*\n\n{result}", reply_markup=get_main_keyboard(True), parse_mode='Markdown', **kw)
+        context.user_data.clear()
+        context.user_data[LAST_EDIT_KEY] = fingerprint
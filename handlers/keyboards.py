@@ -0,0 +1,73 @@
+# handlers/keyboards.py
+import json
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+from flows import MACHINE, NCO_SKIP_CLEAR_ROWS, main_menu_rows
+
+
+class _SerializedOnce:
+    """Примесь к разметке PTB: сериализуется один раз — при создании.
+
+    PTB вызывает to_dict() у reply_markup на каждую отправку и обходит все
+    кнопки; здесь хранится готовый JSON, и to_dict() только разбирает его
+    (json.loads — на C, дешевле обхода объектов PTB). Каждый вызов получает
+    свой словарь: изменения у вызывающего не попадут в общую клавиатуру.
+    Объекты PTB заморожены, поэтому кэш записывается внутри _unfrozen().
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._payload_json = json.dumps(super().to_dict())
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        return json.loads(self._payload_json)
+
+
+class CachedReplyKeyboardMarkup(_SerializedOnce, ReplyKeyboardMarkup):
+    __slots__ = ("_payload_json",)
+
+
+class CachedInlineKeyboardMarkup(_SerializedOnce, InlineKeyboardMarkup):
+    """Для постоянных inline-клавиатур (без меняющихся callback_data)."""
+
+    __slots__ = ("_payload_json",)
+
+
+class KeyboardRegistry:
+    """Все клавиатуры бота, собранные один раз.
+
+    Одинаковые раскладки дают один и тот же объект, так что
+    сериализация каждой клавиатуры происходит ровно однажды.
+    """
+
+    def __init__(self):
+        self._reply: dict[tuple, CachedReplyKeyboardMarkup] = {}
+        self._main = {has_data: self.reply(main_menu_rows(has_data)) for has_data in (False, True)}
+        self.view_nco = CachedInlineKeyboardMarkup([[
+            InlineKeyboardButton("✏️ Изменить информацию об НКО", callback_data="edit_nco")
+        ]])
+        # Клавиатуры шагов и та, что handlers_nco подставляет в режиме правки
+        for state in MACHINE.states.values():
+            if state.keyboard:
+                self.reply(state.keyboard)
+        self.reply(NCO_SKIP_CLEAR_ROWS)
+
+    def reply(self, rows: tuple) -> CachedReplyKeyboardMarkup:
+        markup = self._reply.get(rows)
+        if markup is None:
+            markup = self._reply[rows] = CachedReplyKeyboardMarkup([list(row) for row in rows], resize_keyboard=True)
+        return markup
+
+    def main(self, has_data: bool) -> CachedReplyKeyboardMarkup:
+        return self._main[bool(has_data)]
+
+    def __len__(self) -> int:
+        return len(self._reply) + 1
+
+
+KEYBOARDS = KeyboardRegistry()
+reply_keyboard = KEYBOARDS.reply
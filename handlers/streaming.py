@@ -0,0 +1,71 @@
+# handlers/streaming.py
+import time
+from typing import AsyncIterator
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+# Telegram допускает примерно одно редактирование сообщения в секунду на чат
+EDIT_INTERVAL = 1.5
+MAX_MESSAGE_LEN = 4096
+
+
+async def stream_to_message(message: Message, chunks: AsyncIterator[str], header: str = "") -> str:
+    """Постепенно редактирует message по мере генерации; возвращает итоговый текст.
+
+    Первый фрагмент показывается сразу, дальше правки не чаще EDIT_INTERVAL.
+    """
+    text = ""
+    shown = ""
+    next_edit = 0.0
+    try:
+        async for text in chunks:
+            now = time.monotonic()
+            if now < next_edit or text == shown:
+                continue
+            preview = (header + text)[:MAX_MESSAGE_LEN - 2] + " ▌"
+            try:
+                await message.edit_text(preview)
+                shown = text
+                next_edit = now + EDIT_INTERVAL
+            except RetryAfter as e:
+                retry = e.retry_after
+                next_edit = now + (retry.total_seconds() if hasattr(retry, 'total_seconds') else retry)
+            except TelegramError:
+                # Черновик не обновился (BadRequest, сеть) — не повод бросать генерацию
+                next_edit = now + EDIT_INTERVAL
+    finally:
+        # При ошибке или отмене генератор закрывается сразу, а с ним и запрос к модели
+        await chunks.aclose()
+    return text.strip()
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LEN) -> list[str]:
+    """Делит длинный текст на части не длиннее limit, по возможности по строкам."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+async def finish_stream(message: Message, text: str, parse_mode: str = 'Markdown'):
+    """Заменяет черновик итоговым текстом; если разметка не разобралась — без неё.
+
+    Что не влезло в одно сообщение, досылается следующими.
+    """
+    first, *rest = split_message(text)
+    try:
+        await message.edit_text(first, parse_mode=parse_mode)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            await message.edit_text(first)
+    for part in rest:
+        try:
+            await message.chat.send_message(part, parse_mode=parse_mode)
+        except BadRequest:
+            await message.chat.send_message(part)
@@ -0,0 +1,131 @@
+# image_cache.py
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+
+class ImageCache:
+    """Кэш сгенерированных картинок по содержимому запроса.
+
+    yandex-art с фиксированным seed детерминирован, поэтому одинаковый промт
+    даёт одинаковую картинку. Байты лежат на диске (LRU с лимитом по размеру),
+    рядом хранится file_id из Telegram — повтор отправляется без загрузки.
+    """
+
+    def __init__(self, directory: str = "image_cache", max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._file_ids: dict[str, str] = {}
+        self._total = 0
+        self._load_index()
+
+    @staticmethod
+    def make_key(prompt: list, model_config: dict) -> str:
+        raw = json.dumps([prompt, model_config], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _load_index(self):
+        entries = []
+        fids = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            path = os.path.join(self.directory, name)
+            if ext == ".img":
+                st = os.stat(path)
+                entries.append((st.st_mtime, key, st.st_size))
+            elif ext == ".fid":
+                fids.append((key, path))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._total += size
+        for key, path in fids:
+            if key not in self._sizes:
+                # Картинку уже вытеснили — file_id без неё не вытеснится никогда
+                os.unlink(path)
+                continue
+            with open(path, encoding="utf-8") as f:
+                self._file_ids[key] = f.read().strip()
+
+    # ── file_id ──────────────────────────────────────────────────────
+    def get_file_id(self, key: str) -> Optional[str]:
+        file_id = self._file_ids.get(key)
+        if file_id:
+            self.hits += 1
+            # Попадание по file_id — тоже использование: картинка не должна вытесняться первой
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return file_id
+
+    async def set_file_id(self, key: str, file_id: str):
+        if key not in self._sizes:
+            return  # картинку успели вытеснить, пока она отправлялась
+        self._file_ids[key] = file_id
+        await asyncio.to_thread(self._write, self._path(key, "fid"), file_id.encode("utf-8"))
+
+    # ── байты ────────────────────────────────────────────────────────
+    async def get(self, key: str) -> Optional[bytes]:
+        if key not in self._sizes:
+            self.misses += 1
+            return None
+        self._sizes.move_to_end(key)
+        try:
+            data = await asyncio.to_thread(self._read, self._path(key, "img"))
+        except OSError:
+            self._forget(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes):
+        await asyncio.to_thread(self._write, self._path(key, "img"), data)
+        self._total += len(data) - self._sizes.pop(key, 0)
+        self._sizes[key] = len(data)
+        evicted = []
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            old, _ = next(iter(self._sizes.items()))
+            self._forget(old)
+            evicted.append(old)
+        if evicted:
+            await asyncio.to_thread(self._remove, evicted)
+
+    def _forget(self, key: str):
+        self._total -= self._sizes.pop(key, 0)
+        self._file_ids.pop(key, None)
+
+    # ── диск (в рабочем потоке) ──────────────────────────────────────
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return data
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _remove(self, keys: list[str]):
+        for key in keys:
+            for ext in ("img", "fid"):
+                try:
+                    os.unlink(self._path(key, ext))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        return {'size': len(self._sizes), 'bytes': self._total, 'hits': self.hits, 'misses': self.misses}
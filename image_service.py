@@ -1,21 +1,41 @@
 # image_service.py
 from yandex_cloud_ml_sdk import AsyncYCloudML
-from typing import Optional
+from dataclasses import dataclass
+from typing import Optional, Union
 from config import Config
+from image_cache import ImageCache
+from metrics import metrics
+from scheduler import FairScheduler, Throttled
+
+
+@dataclass
+class GeneratedImage:
+    key: str
+    data: Optional[bytes] = None
+    file_id: Optional[str] = None
+
+    @property
+    def photo(self) -> Union[str, bytes]:
+        # file_id отправляется мгновенно, без повторной загрузки
+        return self.file_id or self.data
 
 
 class ImageService:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, limiter: Optional[FairScheduler] = None):
         self.sdk = AsyncYCloudML(
             folder_id=config.YANDEX_FOLDER_ID,
             auth=config.YANDEX_OAUTH_TOKEN,
         )
         self.sdk.setup_default_logging()
 
+        self.model_config = {'width_ratio': 1, 'height_ratio': 2, 'seed': 42}
         self.model = self.sdk.models.image_generation('yandex-art')
-        self.model = self.model.configure(width_ratio=1, height_ratio=2, seed=42)
+        self.model = self.model.configure(**self.model_config)
 
-    async def generate_image(self, prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None) -> Optional[bytes]:
+        self.cache = ImageCache(config.IMAGE_CACHE_DIR, config.IMAGE_CACHE_MAX_BYTES)
+        self.limiter = limiter or FairScheduler(config.AI_MAX_CONCURRENCY)
+
+    async def generate_image(self, prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None) -> Optional[GeneratedImage]:
         context = ""
         if nco_info and nco_info.get('name'):
             context = f"Для НКО «{nco_info['name']}». "
@@ -35,12 +55,33 @@ class ImageService:
             "эмоционально, тепло, высокое качество, без текста на изображении, профессиональная композиция"
         ]
 
+        key = ImageCache.make_key(full_prompt, {'model': 'yandex-art', **self.model_config})
+        file_id = self.cache.get_file_id(key)
+        if file_id:
+            print(f"[ART] Из кэша (file_id): {key[:12]}")
+            return GeneratedImage(key, file_id=file_id)
+        data = await self.cache.get(key)
+        if data:
+            print(f"[ART] Из кэша (диск): {key[:12]}")
+            return GeneratedImage(key, data=data)
+
         print(f"[ART] Промт: {full_prompt[0][:500]}...")
 
         try:
-            operation = await self.model.run_deferred(full_prompt)
-            result = await operation
-            return result.image_bytes
+            async with self.limiter.slot('image'):
+                with metrics.timer('model', model='yandex-art', kind='image'):
+                    operation = await self.model.run_deferred(full_prompt)
+                    result = await operation
+        except Throttled:
+            raise  # квота исчерпана — пользователю нужен срок, а не общая ошибка
         except Exception as e:
             print(f"[ART] Ошибка: {e}")
             return None
+        await self.cache.put(key, result.image_bytes)
+        return GeneratedImage(key, data=result.image_bytes)
+
+    async def remember_sent(self, image: GeneratedImage, message):
+        """Запоминает file_id отправленного фото, чтобы повторно слать его без загрузки."""
+        if image.file_id or not message or not message.photo:
+            return
+        await self.cache.set_file_id(image.key, message.photo[-1].file_id)
@@ -0,0 +1,245 @@
+# jobs.py
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+
+from image_service import ImageService
+from scheduler import Throttled, requester
+
+
+CANCEL_PREFIX = "image_cancel:"
+
+
+@dataclass
+class ImageJob:
+    user_id: int
+    chat_id: int
+    prompt: str
+    nco_info: dict
+    style: Optional[str]
+    caption: str
+    fail_text: str
+    reply_to_message_id: Optional[int] = None
+    reply_markup: object = None
+    id: int = 0
+    status_message_id: Optional[int] = None
+    queued: bool = False
+    cancelled: bool = False
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def cancel_markup(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отменить", callback_data=f"{CANCEL_PREFIX}{self.id}")]])
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ImageJobQueue:
+    """Очередь генерации картинок с пулом фоновых воркеров.
+
+    Обработчик только ставит задачу и сразу отпускает пользователя;
+    воркер генерирует картинку, показывает прогресс в статусном сообщении
+    и сам отправляет результат в чат.
+    """
+
+    def __init__(self, image_service: ImageService, workers: int = 2, maxsize: int = 100, per_user: int = 2,
+                 progress_interval: float = 15.0):
+        self.isvc = image_service
+        self.workers = workers
+        self.maxsize = maxsize
+        self.per_user = per_user
+        self.progress_interval = progress_interval
+        self.bot: Optional[Bot] = None
+
+        self._pending: deque[ImageJob] = deque()
+        self._jobs: dict[int, ImageJob] = {}
+        self._ids = itertools.count(1)
+        self._ready = asyncio.Event()
+        self._worker_tasks: list[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    # ── ЖИЗНЕННЫЙ ЦИКЛ ───────────────────────────────────────────────
+    async def start(self, bot: Bot):
+        self.bot = bot
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    # ── ПОСТАНОВКА И ОТМЕНА ──────────────────────────────────────────
+    def user_jobs(self, user_id: int) -> int:
+        return sum(1 for job in self._jobs.values() if job.user_id == user_id)
+
+    async def submit(self, job: ImageJob) -> int:
+        """Ставит задачу в очередь и присылает статусное сообщение с кнопкой отмены.
+
+        Возвращает позицию в очереди (0 — свободный воркер возьмёт задачу сразу).
+        """
+        if len(self._pending) >= self.maxsize or self.user_jobs(job.user_id) >= self.per_user:
+            raise QueueFull()
+        job.id = next(self._ids)
+        self._jobs[job.id] = job
+
+        running = len(self._jobs) - 1 - len(self._pending)
+        position = 0 if running < self.workers and not self._pending else len(self._pending) + 1
+        job.queued = position > 0
+        try:
+            status = await self.bot.send_message(
+                job.chat_id,
+                queue_text(position) if job.queued else GENERATING_TEXT,
+                reply_markup=job.cancel_markup,
+                reply_to_message_id=job.reply_to_message_id
+            )
+        except Exception:
+            self._jobs.pop(job.id, None)
+            raise
+        # В очередь — только когда статус уже есть, иначе воркеру нечего обновлять
+        job.status_message_id = status.message_id
+        self._pending.append(job)
+        self._ready.set()
+        return position
+
+    def position(self, job: ImageJob) -> int:
+        try:
+            return self._pending.index(job) + 1
+        except ValueError:
+            return 0
+
+    async def cancel(self, job_id: int, user_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id or job.cancelled:
+            return False
+        job.cancelled = True
+        self.cancelled += 1
+        if job in self._pending:
+            self._pending.remove(job)
+            self._jobs.pop(job.id, None)
+            await self._update_queue_positions()
+        elif job.task is not None:
+            job.task.cancel()
+        await self._set_status(job, "❌ Генерация картинки отменена.", with_cancel=False)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'running': len(self._jobs) - len(self._pending),
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+        }
+
+    # ── ВОРКЕР ───────────────────────────────────────────────────────
+    async def _next_job(self) -> ImageJob:
+        while not self._pending:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._pending.popleft()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            await self._update_queue_positions()
+            try:
+                await self._run(job)
+            except Exception as e:
+                print(f"[ART] Ошибка задачи #{job.id}: {e}")
+            finally:
+                self._jobs.pop(job.id, None)
+
+    async def _run(self, job: ImageJob):
+        if job.cancelled:
+            return
+        if job.queued:
+            await self._set_status(job, GENERATING_TEXT)
+            # Пока правился статус, задачи ещё нет — отмену в это время ловим здесь
+            if job.cancelled:
+                return
+        # Генерация — отдельная задача, чтобы отмена не останавливала сам воркер;
+        # она наследует requester, и планировщик учтёт квоту автора задачи
+        requester.set((job.user_id, job.chat_id))
+        job.task = asyncio.create_task(self.isvc.generate_image(job.prompt, job.nco_info, job.style))
+        started = time.monotonic()
+        try:
+            while True:
+                done, _ = await asyncio.wait({job.task}, timeout=self.progress_interval)
+                if done:
+                    break
+                if not job.cancelled:
+                    await self._set_status(job, generating_text(time.monotonic() - started))
+            img = job.task.result()
+        except asyncio.CancelledError:
+            # Воркер останавливают — генерация не должна пережить его
+            job.task.cancel()
+            if job.cancelled:
+                return
+            raise
+        except Throttled as e:
+            self.failed += 1
+            await self._set_status(job, f"😕 {e}", with_cancel=False)
+            return
+
+        if img is None:
+            self.failed += 1
+            await self._set_status(job, job.fail_text, with_cancel=False)
+            return
+
+        sent = await self.bot.send_photo(
+            chat_id=job.chat_id,
+            photo=img.photo,
+            caption=job.caption,
+            reply_markup=job.reply_markup,
+            reply_to_message_id=job.reply_to_message_id
+        )
+        self.completed += 1
+        await self.isvc.remember_sent(img, sent)
+        await self._delete_status(job)
+
+    # ── СТАТУСНОЕ СООБЩЕНИЕ ──────────────────────────────────────────
+    async def _set_status(self, job: ImageJob, text: str, with_cancel: bool = True):
+        if job.status_message_id is None:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=job.chat_id, message_id=job.status_message_id,
+                reply_markup=job.cancel_markup if with_cancel else None
+            )
+        except TelegramError:
+            pass
+
+    async def _delete_status(self, job: ImageJob):
+        if job.status_message_id is None:
+            return
+        try:
+            await self.bot.delete_message(chat_id=job.chat_id, message_id=job.status_message_id)
+        except TelegramError:
+            pass
+
+    async def _update_queue_positions(self, limit: int = 5):
+        # Обновляем только первые позиции: дальше очереди пользователю важнее сам факт ожидания
+        for position, job in enumerate(list(self._pending)[:limit], 1):
+            await self._set_status(job, queue_text(position))
+
+
+GENERATING_TEXT = "🎨 Генерирую картинку... Обычно это занимает не больше минуты! ⏳"
+
+
+def generating_text(elapsed: float) -> str:
+    return f"🎨 Генерирую картинку... Прошло {elapsed:.0f} с, скоро будет готово! ⏳"
+
+
+def queue_text(position: int) -> str:
+    return f"⏳ Картинка в очереди: {position}-я. Как только подойдёт очередь — начну рисовать!"
@@ -0,0 +1,66 @@
+# locks.py
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+from metrics import metrics
+
+
+class _Entry:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class UserLockRegistry:
+    """Блокировки по пользователю, которые создаются по требованию.
+
+    Запись живёт, пока её кто-то держит или ждёт (счётчик ссылок), и удаляется
+    сразу после освобождения — словарь не растёт с числом пользователей.
+    """
+
+    def __init__(self):
+        self._entries: dict[Hashable, _Entry] = {}
+        self.acquired = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.refs += 1
+        try:
+            if entry.lock.locked():
+                self.contended += 1
+            started = time.monotonic()
+            async with entry.lock:
+                waited = time.monotonic() - started
+                self.acquired += 1
+                self.wait_total += waited
+                if waited > self.wait_max:
+                    self.wait_max = waited
+                metrics.observe('lock_wait', waited)
+                yield
+        finally:
+            entry.refs -= 1
+            if entry.refs == 0:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            'live': len(self._entries),
+            'acquired': self.acquired,
+            'contended': self.contended,
+            'wait_total': self.wait_total,
+            'wait_avg': self.wait_total / self.acquired if self.acquired else 0.0,
+            'wait_max': self.wait_max,
+        }
@@ -1,6 +1,10 @@
 # main.py
 import logging
 import asyncio
+try:
+    import fcntl
+except ImportError:  # Windows — проверку одного экземпляра пропускаем
+    fcntl = None
 from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, ContextTypes,
@@ -10,49 +14,114 @@ from telegram.ext import (
 from config import Config
 from text_service import TextService
 from image_service import ImageService
-from attachment_service import AttachmentService
+from attachment_service import AttachmentService, ExtractionError
 from db import Database
+from locks import UserLockRegistry
+from processing import UserOrderedUpdateProcessor, InstrumentedRequest
+from metrics import metrics
+from persistence import SQLitePersistence
+from scheduler import FairScheduler
+from jobs import ImageJobQueue, CANCEL_PREFIX
 from handlers import (
     TextCreateHandler, ImageHandler, PlanHandler,
     TextEditHandler, NCOHandler
 )
 from handlers.handlers_nco import get_main_keyboard
+from handlers.handlers_text_create import style_kb as text_style_kb
+from handlers.handlers_text_edit import action_kb as edit_action_kb
+from media_group import MediaGroupCollector
+from router import Router, BACK_BUTTON, IDLE_BUTTONS, NCO_BUTTONS, SECTION_BUTTONS
+from flows import dialog
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # ── БЛОКИРОВКИ ПО ПОЛЬЗОВАТЕЛЮ ───────────────────────────────────────
-user_locks: dict[int, asyncio.Lock] = {}
+# Берутся в UserOrderedUpdateProcessor: обновления одного пользователя идут по очереди
+user_locks = UserLockRegistry()
 
 
 async def post_init(app: Application):
-    if app.bot_data['text_service'].check_health():
+    cfg = app.bot_data['config']
+    await metrics.start(cfg.METRICS_PORT, cfg.METRICS_HOST, cfg.METRICS_LOG_INTERVAL, cfg.LOOP_LAG_INTERVAL)
+    if await app.bot_data['text_service'].check_health():
         logger.info("YandexGPT подключён")
+    await app.bot_data['image_jobs'].start(app.bot)
 
 
-async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
-    logger.error(f"Ошибка: {context.error}")
+async def post_shutdown(app: Application):
+    await app.bot_data['image_jobs'].stop()
+    await app.bot_data['attachment_service'].close()
+    await app.bot_data['db'].close()
+    await metrics.stop()
 
 
-def main():
-    cfg = Config.from_env()
-    db = Database()
-    ts = TextService(cfg)
-    img = ImageService(cfg)
-    att = AttachmentService(cfg)
+def reply_kwargs_for(update: Update) -> dict:
+    # В группах отвечаем реплаем на сообщение пользователя
+    if update.message and update.message.chat.type in ['group', 'supergroup']:
+        return {'reply_to_message_id': update.message.message_id}
+    return {}
+
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    logger.error(f"Ошибка: {context.error}")
+    metrics.inc('errors', source='handler')
+
+
+def build_application(cfg: Config) -> Application:
+    """Собирает приложение со всеми сервисами и обработчиками, не запуская его."""
+    metrics.enabled = cfg.METRICS_ENABLED
+    db = Database(cfg.DB_PATH)
+    limiter = FairScheduler(cfg.AI_MAX_CONCURRENCY, cfg.AI_USER_RATE, cfg.AI_USER_BURST,
+                            cfg.AI_CHAT_RATE, cfg.AI_CHAT_BURST)
+    ts = TextService(cfg, limiter)
+    img = ImageService(cfg, limiter)
+    att = AttachmentService(cfg, db)
+    jobs = ImageJobQueue(img, cfg.IMAGE_WORKERS, cfg.IMAGE_QUEUE_SIZE, cfg.IMAGE_JOBS_PER_USER,
+                         cfg.IMAGE_PROGRESS_INTERVAL)
+    media_groups = MediaGroupCollector(cfg.MEDIA_GROUP_WINDOW)
 
     nco = NCOHandler(db)
     handlers = {
         'text': TextCreateHandler(ts),
-        'image': ImageHandler(img),
+        'image': ImageHandler(img, jobs),
         'plan': PlanHandler(ts),
         'edit': TextEditHandler(ts),
         'nco': nco
     }
 
-    app = Application.builder().token(cfg.TELEGRAM_BOT_TOKEN).post_init(post_init).build()
-    app.bot_data.update({'text_service': ts, 'db': db, 'handlers': handlers, 'nco': nco})
+    builder = Application.builder().token(cfg.TELEGRAM_BOT_TOKEN)
+    if cfg.TELEGRAM_API_URL:
+        # Локальный сервер Bot API или заглушка из benchmarks/loadtest.py
+        api_url = cfg.TELEGRAM_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    if cfg.METRICS_ENABLED:
+        # Размер пула — как у запроса по умолчанию в ApplicationBuilder
+        builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+    processor = UserOrderedUpdateProcessor(cfg.UPDATE_CONCURRENCY, user_locks, cfg.UPDATE_MAX_PENDING)
+    app = (
+        builder
+        .update_queue(asyncio.Queue(maxsize=cfg.UPDATE_QUEUE_SIZE))
+        .concurrent_updates(processor)
+        .persistence(SQLitePersistence(db, update_interval=cfg.PERSISTENCE_INTERVAL))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    app.bot_data.update({'text_service': ts, 'attachment_service': att, 'db': db, 'handlers': handlers, 'nco': nco,
+                         'user_locks': user_locks, 'ai_scheduler': limiter, 'image_jobs': jobs, 'config': cfg})
+
+    # Статистика, которую модули считают сами, — в метрики в момент выгрузки
+    metrics.register('user_locks', user_locks.stats)
+    metrics.register('ai_scheduler', limiter.stats)
+    metrics.register('image_jobs', jobs.stats)
+    metrics.register('image_cache', img.cache.stats)
+    metrics.register('attachments', att.stats)
+    metrics.register('nco_cache', db.stats)
+    metrics.register('prompts', lambda: ts.prompt_stats)
+    if ts.cache is not None:
+        metrics.register('text_cache', ts.cache.stats)
 
     # ───────────────────────────────────────────────────────────────
     # /start — адаптировано для ЛС и групп
@@ -70,11 +139,8 @@ def main():
 
         # ── ЛИЧНЫЕ СООБЩЕНИЯ ─────────────────────────────────-
         user_id = update.effective_user.id
-        if user_id not in user_locks:
-            user_locks[user_id] = asyncio.Lock()
-
         context.user_data.clear()
-        has_data = nco.has_data(user_id)
+        has_data = await nco.has_data(user_id)
         await update.message.reply_text(
             "👋 Привет! Я твой помощник по созданию контента для НКО.\n\n"
             "📸 Можешь загрузить фото или документ — я извлеку текст и сделаю пост!\n"
@@ -103,151 +169,203 @@ def main():
         )
 
     # ───────────────────────────────────────────────────────────────
-    # ГЛАВНЫЙ ОБРАБОТЧИК
+    # ВЛОЖЕНИЯ
     # ───────────────────────────────────────────────────────────────
-    async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        if user_id not in user_locks:
-            user_locks[user_id] = asyncio.Lock()
-
-        async with user_locks[user_id]:
-
-            # ────────────────────────────────────────────────
-            # ГРУППЫ — работа только после команды /nco_postgenerator_bot
-            # ────────────────────────────────────────────────
-            if update.message and update.message.chat.type in ['group', 'supergroup']:
-                if not context.user_data.get('active_session') or \
-                   update.effective_user.id != context.user_data.get('session_user_id'):
-                    return
+    async def extract_one(message) -> tuple[str, str]:
+        try:
+            return (await att.process_attachment(message) or "").strip(), ""
+        except ExtractionError as e:
+            return "", str(e)
+
+    async def extract_text(messages) -> tuple[str, list[str]]:
+        """Текст всех вложений и ошибки по тем, что прочитать не удалось.
+
+        Ошибки в текст не попадают — их показываем пользователю отдельно.
+        """
+        results = await asyncio.gather(*(extract_one(m) for m in messages))
+        content = "\n\n".join(text for text, _ in results if text)
+        if len(messages) == 1:
+            errors = [error for _, error in results if error]
+        else:
+            errors = [f"файл {i}: {error}" for i, (_, error) in enumerate(results, 1) if error]
+        return content, errors
+
+    def extraction_report(errors: list[str]) -> str:
+        if len(errors) == 1:
+            return errors[0]
+        return "\n".join(f"• {error}" for error in errors)
+
+    async def reply_extraction_errors(update: Update, content: str, errors: list[str], reply_kwargs: dict, **markup):
+        if not errors:
+            return
+        if content:
+            await update.message.reply_text(
+                f"⚠️ Часть вложений прочитать не удалось, они пропущены:\n{extraction_report(errors)}",
+                **reply_kwargs
+            )
+        else:
+            await update.message.reply_text(
+                f"❌ Не удалось извлечь текст из файла.\n{extraction_report(errors)}",
+                **markup,
+                **reply_kwargs
+            )
 
-            reply_kwargs = {}
-            if update.message and update.message.chat.type in ['group', 'supergroup']:
-                reply_kwargs['reply_to_message_id'] = update.message.message_id
+    async def handle_attachments(update: Update, context: ContextTypes.DEFAULT_TYPE, messages, reply_kwargs: dict) -> bool:
+        d = dialog(context.user_data)
+        flow = d.flow
 
-            # ── CALLBACK ----------------------------------------------------------------
-            if update.callback_query:
-                await nco.handle_callback(update, context)
-                return
+        if flow == 'image':
+            await update.message.reply_text(
+                "❌ В генерации изображений не поддерживается загрузка файлов.",
+                **reply_kwargs
+            )
+            return True
 
-            # ── ВЛОЖЕНИЯ (фото / документ) ---------------------------------------------
-            if update.message and (update.message.photo or update.message.document):
-                waiting = context.user_data.get('waiting', '')
-
-                if waiting.startswith('image_'):
-                    await update.message.reply_text(
-                        "❌ В генерации изображений не поддерживается загрузка файлов.",
-                        **reply_kwargs
-                    )
-                    return
-
-                if waiting.startswith('plan_'):
-                    await update.message.reply_text(
-                        "❌ Работа с файлами в контент-плане не поддерживается.",
-                        **reply_kwargs
-                    )
-                    context.user_data['waiting'] = 'plan_theme'
-                    from handlers.handlers_plan import PlanHandler
-                    plan_handler = PlanHandler(app.bot_data['text_service'])
-                    await plan_handler.start(update, context, **reply_kwargs)
-                    return
-
-                if waiting == 'edit_text':
-                    await update.message.reply_text("📄 Анализирую вложение...", **reply_kwargs)
-                    content = await att.process_attachment(update.message)
-                    if content and content.strip():
-                        context.user_data['original_text'] = content
-                        context.user_data['waiting'] = 'edit_style'
-                        from telegram import ReplyKeyboardMarkup
-                        await update.message.reply_text(
-                            "✅ Текст извлечён! Выбери стиль редактирования:",
-                            reply_markup=ReplyKeyboardMarkup([
-                                ["📉 Сделать короче", "📈 Сделать длиннее"],
-                                ["📋 Сделать формальнее", "💬 Сделать проще"],
-                                ["😊 Добавить эмодзи", "🚫 Убрать эмодзи"],
-                                ["🏠 Назад в главное меню"]
-                            ], resize_keyboard=True),
-                            **reply_kwargs
-                        )
-                    else:
-                        await update.message.reply_text("❌ Не удалось извлечь текст из файла.", **reply_kwargs)
-                    return
-
-                # Текст из вложения → генератор текста
-                if not waiting or waiting.startswith('text_') or waiting == 'select_style':
-                    await update.message.reply_text("📄 Анализирую вложение...", **reply_kwargs)
-                    content = await att.process_attachment(update.message)
-                    if content and content.strip():
-                        context.user_data.update({'text_prompt': content, 'waiting': 'select_style'})
-                        from handlers.handlers_text_create import style_kb
-                        await update.message.reply_text(
-                            "✅ Готово! Текст извлечён.\n\nВыбери стиль для поста:",
-                            reply_markup=style_kb,
-                            **reply_kwargs
-                        )
-                    else:
-                        await update.message.reply_text(
-                            "❌ Не удалось извлечь текст из файла.",
-                            reply_markup=get_main_keyboard(True),
-                            **reply_kwargs
-                        )
-                    return
-
-            # ────────────────────────────────────────────────
-            # ТЕКСТОВОЕ СООБЩЕНИЕ
-            # ────────────────────────────────────────────────
-            text = update.message.text.strip() if update.message and update.message.text else None
-            nco_info = nco.get_nco_info(update)
-            kw = reply_kwargs
-
-            if text == "🏠 Назад в главное меню":
-                context.user_data.clear()
-                has_data = nco.has_data(user_id)
-                await update.message.reply_text("👌 Возврат в главное меню.", reply_markup=get_main_keyboard(has_data), **kw)
-                return
+        if flow == 'plan':
+            await update.message.reply_text(
+                "❌ Работа с файлами в контент-плане не поддерживается.",
+                **reply_kwargs
+            )
+            await handlers['plan'].start(update, context, **reply_kwargs)
+            return True
+
+        if d.name == 'edit_text':
+            await update.message.reply_text("📄 Анализирую вложение...", **reply_kwargs)
+            content, errors = await extract_text(messages)
+            await reply_extraction_errors(update, content, errors, reply_kwargs)
+            if content:
+                nco_info = await nco.get_nco_info(update)
+                content = ts.fit_user_text(content, nco_info, edit=True)
+                d.go('edit_action', text=content)
+                await update.message.reply_text(
+                    "✅ Текст извлечён! Что сделать с текстом? Выбери действие:",
+                    reply_markup=edit_action_kb,
+                    **reply_kwargs
+                )
+            elif not errors:
+                await update.message.reply_text("❌ Не удалось извлечь текст из файла.", **reply_kwargs)
+            return True
+
+        # Текст из вложения → генератор текста
+        if flow is None or flow == 'text':
+            await update.message.reply_text("📄 Анализирую вложение...", **reply_kwargs)
+            content, errors = await extract_text(messages)
+            await reply_extraction_errors(update, content, errors, reply_kwargs, reply_markup=get_main_keyboard(True))
+            if content:
+                nco_info = await nco.get_nco_info(update)
+                content = ts.fit_user_text(content, nco_info)
+                d.go('select_style', prompt=content)
+                await update.message.reply_text(
+                    "✅ Готово! Текст извлечён.\n\nВыбери стиль для поста:",
+                    reply_markup=text_style_kb,
+                    **reply_kwargs
+                )
+            elif not errors:
+                await update.message.reply_text(
+                    "❌ Не удалось извлечь текст из файла.",
+                    reply_markup=get_main_keyboard(True),
+                    **reply_kwargs
+                )
+            return True
+
+        return False
+
+    async def process_album(key, context: ContextTypes.DEFAULT_TYPE):
+        updates = await media_groups.collect(key)
+        first = updates[0]
+        # Задача живёт вне UserOrderedUpdateProcessor — порядок держим той же блокировкой
+        async with user_locks.hold(first.effective_user.id):
+            reply_kwargs = reply_kwargs_for(first)
+            if not await handle_attachments(first, context, [u.message for u in updates], reply_kwargs):
+                # Одиночный файл ушёл бы дальше в маршрутизатор, а альбом — нет:
+                # в анкете НКО и посреди редактирования файлы не принимаем
+                await first.message.reply_text(
+                    "❌ Здесь файлы не принимаются. Закончи текущий шаг или вернись в меню.",
+                    **reply_kwargs
+                )
 
-            if text in ["🏠 Назад в главное меню", "⏭️ Пропустить", "🧹 Очистить"] and not context.user_data.get('waiting'):
-                return
+    # ───────────────────────────────────────────────────────────────
+    # МАРШРУТЫ ТЕКСТОВЫХ СООБЩЕНИЙ
+    # ───────────────────────────────────────────────────────────────
+    async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kw: dict):
+        has_data = await nco.has_data(update.effective_user.id)
+        await update.message.reply_text("👋 Выбери действие из меню:", reply_markup=get_main_keyboard(has_data), **kw)
 
-            if text in ["➕ Предоставить информацию об НКО", "👁️ Просмотреть информацию об НКО"]:
-                if not nco.has_data(user_id):
-                    await nco.start_nco_input(update, context, is_edit=False, **kw)
-                else:
-                    await nco.show_nco_info(update, context, **kw)
-                return
+    async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kw: dict):
+        context.user_data.clear()
+        has_data = await nco.has_data(update.effective_user.id)
+        await update.message.reply_text("👌 Возврат в главное меню.", reply_markup=get_main_keyboard(has_data), **kw)
+
+    async def ignore(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kw: dict):
+        pass
+
+    async def nco_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kw: dict):
+        if not await nco.has_data(update.effective_user.id):
+            await nco.start_nco_input(update, context, is_edit=False, **kw)
+        else:
+            await nco.show_nco_info(update, context, **kw)
+
+    def section(handler):
+        async def route(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kw: dict):
+            await handler.start(update, context, **kw)
+        return route
+
+    def flow_step(handler, with_profile: bool = True):
+        async def route(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kw: dict):
+            nco_info = await nco.get_nco_info(update) if with_profile else None
+            if not await handler.handle(update, context, text, nco_info, **kw):
+                await show_menu(update, context, text, kw)
+        return route
+
+    router = Router(default=show_menu)
+    router.on_button(BACK_BUTTON, back_to_menu)
+    router.on_button(NCO_BUTTONS, nco_menu)
+    for button, flow in SECTION_BUTTONS.items():
+        router.on_button(button, section(handlers[flow]))
+    router.on_button(IDLE_BUTTONS, ignore, idle_only=True)
+    router.on_flow('nco', flow_step(nco, with_profile=False))
+    for flow in ('text', 'image', 'edit', 'plan'):
+        router.on_flow(flow, flow_step(handlers[flow]))
 
-            # Основные разделы
-            if text in ["📝 Генерация текста", "🎨 Генерация изображения", "✏️ Редактор текста", "📅 Контент-план"]:
-                # Убираем эмодзи для поиска в handlers
-                clean_text = text.replace("📝 ", "").replace("🎨 ", "").replace("✏️ ", "").replace("📅 ", "")
-                h = handlers[['text', 'image', 'edit', 'plan'][["Генерация текста", "Генерация изображения", "Редактор текста", "Контент-план"].index(clean_text)]]
-                await h.start(update, context, **kw)
+    # ───────────────────────────────────────────────────────────────
+    # ГЛАВНЫЙ ОБРАБОТЧИК
+    # ───────────────────────────────────────────────────────────────
+    async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # ────────────────────────────────────────────────
+        # ГРУППЫ — работа только после команды /nco_postgenerator_bot
+        # ────────────────────────────────────────────────
+        if update.message and update.message.chat.type in ['group', 'supergroup']:
+            if not context.user_data.get('active_session') or \
+               update.effective_user.id != context.user_data.get('session_user_id'):
                 return
 
-            waiting = context.user_data.get('waiting', '')
-
-            if waiting.startswith('nco_'):
-                handled = await nco.handle_nco(update, context, text, **kw)
-                if handled:
-                    return
+        reply_kwargs = reply_kwargs_for(update)
 
-            elif waiting.startswith('text_') or waiting in ['select_style', 'text_prompt', 'select_post_type']:
-                await handlers['text'].handle(update, context, text, nco_info, **kw)
-                return
-
-            elif waiting.startswith('image_'):
-                await handlers['image'].handle(update, context, text, nco_info, **kw)
-                return
+        # ── CALLBACK ----------------------------------------------------------------
+        if update.callback_query:
+            if (update.callback_query.data or "").startswith(CANCEL_PREFIX):
+                await handlers['image'].handle_callback(update, context)
+            else:
+                await nco.handle_callback(update, context)
+            return
 
-            elif waiting.startswith('edit_'):
-                await handlers['edit'].handle(update, context, text, nco_info, **kw)
+        # ── ВЛОЖЕНИЯ (фото / документ) ---------------------------------------------
+        if update.message and (update.message.photo or update.message.document):
+            # Альбом приходит отдельными обновлениями — собираем их и обрабатываем разом
+            if update.message.media_group_id:
+                key = (update.message.chat_id, update.message.media_group_id)
+                if media_groups.add(key, update):
+                    context.application.create_task(process_album(key, context), update=update)
                 return
-
-            elif waiting.startswith('plan_'):
-                await handlers['plan'].handle(update, context, text, nco_info, **kw)
+            if await handle_attachments(update, context, [update.message], reply_kwargs):
                 return
 
-            has_data = nco.has_data(user_id)
-            await update.message.reply_text("👋 Выбери действие из меню:", reply_markup=get_main_keyboard(has_data), **kw)
+        # ────────────────────────────────────────────────
+        # ТЕКСТОВОЕ СООБЩЕНИЕ
+        # ────────────────────────────────────────────────
+        text = update.message.text.strip() if update.message and update.message.text else None
+        route = router.resolve(text, context.user_data.get('state'))
+        await route(update, context, text, reply_kwargs)
 
     # ───────────────────────────────────────────────────────────────
     # РЕГИСТРАЦИЯ ХЕНДЛЕРОВ
@@ -259,9 +377,47 @@ def main():
     app.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, handle))
     app.add_handler(CallbackQueryHandler(handle))
     app.add_error_handler(error_handler)
+    return app
+
+
+# ── ОДИН ЭКЗЕМПЛЯР ───────────────────────────────────────────────────
+# Блокировки пользователей, квоты FairScheduler, кэш НКО в Database и
+# SQLitePersistence живут в памяти процесса, а refresh_* ничего не перечитывают.
+# Две реплики (в том числе за балансировщиком в режиме webhook) разошлись бы
+# в состоянии диалогов и лимитах, поэтому второй процесс с той же базой не стартует.
+def acquire_instance_lock(db_path: str):
+    """Берёт эксклюзивный lock-файл рядом с базой; файл держится открытым до выхода."""
+    lock_file = open(f"{db_path}.lock", "w")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(
+            f"Другой экземпляр бота уже работает с {db_path}. "
+            "Бот поддерживает только одну реплику — в том числе в режиме webhook."
+        )
+    return lock_file
+
+
+def main():
+    cfg = Config.from_env()
+    instance_lock = acquire_instance_lock(cfg.DB_PATH)
+    app = build_application(cfg)
 
     logger.info("✅ Бот запущен и готов к работе!")
-    app.run_polling()
+    if cfg.BOT_MODE == "webhook":
+        app.run_webhook(
+            listen=cfg.WEBHOOK_LISTEN,
+            port=cfg.WEBHOOK_PORT,
+            url_path=cfg.WEBHOOK_PATH,
+            webhook_url=f"{cfg.WEBHOOK_URL.rstrip('/')}/{cfg.WEBHOOK_PATH}",
+            secret_token=cfg.WEBHOOK_SECRET
+        )
+    else:
+        app.run_polling()
+    instance_lock.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,29 @@
+# media_group.py
+import asyncio
+from typing import Hashable
+
+
+class MediaGroupCollector:
+    """Собирает обновления одного альбома (media_group_id) в пачку.
+
+    Telegram присылает каждое фото альбома отдельным обновлением. Первое
+    открывает окно ожидания, остальные за это время просто добавляются.
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._groups: dict[Hashable, list] = {}
+
+    def add(self, key: Hashable, update) -> bool:
+        """Добавляет обновление; True — это первое в альбоме и его нужно собрать через collect()."""
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [update]
+            return True
+        group.append(update)
+        return False
+
+    async def collect(self, key: Hashable) -> list:
+        await asyncio.sleep(self.window)
+        updates = self._groups.pop(key, [])
+        return sorted(updates, key=lambda u: u.message.message_id)
@@ -0,0 +1,257 @@
+# metrics.py
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды: от быстрых запросов к БД до генерации картинок
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает q-я доля замеров."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Timer:
+    __slots__ = ("metrics", "key", "started")
+
+    def __init__(self, metrics: "Metrics", key: tuple):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics._observe(self.key, time.perf_counter() - self.started)
+        # Отмена — не ошибка: пользователь нажал «Отменить» или бот останавливается
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            name, labels = self.key
+            self.metrics.inc('errors', source=name, **dict(labels))
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Счётчики, таймеры этапов и задержка event loop.
+
+    Пока метрики выключены, inc/observe сразу возвращаются, а timer() отдаёт
+    общий пустой контекстный менеджер — на горячем пути остаётся один if.
+    Статистику, которую модули уже считают сами (кэши, блокировки, планировщик,
+    очередь картинок), не дублируем: её отдают функции из register() в момент выгрузки.
+    Выгрузка — текст в формате Prometheus по HTTP и/или строка JSON в лог.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, _Histogram] = {}
+        self.collectors: dict[str, Callable[[], dict]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    # ── ЗАПИСЬ ───────────────────────────────────────────────────────
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        self._observe(self._key(name, labels), seconds)
+
+    def _observe(self, key: tuple, seconds: float):
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = _Histogram()
+        hist.observe(seconds)
+
+    def timer(self, name: str, **labels):
+        """with metrics.timer('attachment', stage='ocr'): ... — время этапа.
+
+        Исключение внутри блока считается в errors{source='attachment', stage='ocr'}.
+        """
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, self._key(name, labels))
+
+    def register(self, name: str, collect: Callable[[], dict]):
+        """collect() возвращает словарь чисел (вложенный словарь — значения с меткой key)."""
+        self.collectors[name] = collect
+
+    # ── ВЫГРУЗКА ─────────────────────────────────────────────────────
+    @staticmethod
+    def _labels(labels, **extra) -> str:
+        items = [*labels, *extra.items()]
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+    def _gauges(self):
+        for group, collect in self.collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Метрики {group}: {e}")
+                continue
+            for name, value in values.items():
+                if isinstance(value, dict):
+                    for key, sub in value.items():
+                        if isinstance(sub, (int, float)):
+                            yield f"bot_{group}_{name}", (('key', key),), sub
+                elif isinstance(value, (int, float)):
+                    yield f"bot_{group}_{name}", (), value
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = f"bot_{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{self._labels(labels)} {value:g}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+            metric = f"bot_{name}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS, hist.counts):
+                cumulative += n
+                lines.append(f"{metric}_bucket{self._labels(labels, le=f'{bound:g}')} {cumulative}")
+            lines.append(f"{metric}_bucket{self._labels(labels, le='+Inf')} {hist.count}")
+            lines.append(f"{metric}_sum{self._labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{metric}_count{self._labels(labels)} {hist.count}")
+        for metric, labels, value in self._gauges():
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{self._labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Сводка для лога: счётчики, p50/p95/max таймеров и значения из register()."""
+        def series(name, labels):
+            return name + "".join(f".{v}" for _, v in labels)
+
+        timers = {}
+        for (name, labels), hist in self.histograms.items():
+            timers[series(name, labels)] = {
+                'n': hist.count, 'avg': round(hist.sum / hist.count, 4) if hist.count else 0.0,
+                'p50': round(hist.quantile(0.5), 4), 'p95': round(hist.quantile(0.95), 4), 'max': round(hist.max, 4),
+            }
+        gauges = {series(metric[4:], labels): round(value, 4) if isinstance(value, float) else value
+                  for metric, labels, value in self._gauges()}
+        counters = {series(name, labels): value for (name, labels), value in self.counters.items()}
+        return {'counters': counters, 'timers': timers, 'gauges': gauges}
+
+    # ── ФОНОВЫЕ ЗАДАЧИ ───────────────────────────────────────────────
+    async def start(self, port: int = 0, host: str = "127.0.0.1", log_interval: float = 0.0,
+                    lag_interval: float = 0.5):
+        if not self.enabled:
+            return
+        if lag_interval > 0:
+            self._tasks.append(asyncio.create_task(self._watch_loop_lag(lag_interval)))
+        if log_interval > 0:
+            self._tasks.append(asyncio.create_task(self._log_periodically(log_interval)))
+        if port:
+            self._server = await asyncio.start_server(self._serve, host, port)
+            logger.info(f"Метрики: http://{host}:{port}/metrics")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _watch_loop_lag(self, interval: float):
+        # Насколько позже запланированного просыпается loop — столько ждёт любая готовая задача
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self._observe(('loop_lag', ()), max(0.0, loop.time() - started - interval))
+
+    async def _log_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info("metrics %s", json.dumps(self.snapshot(), ensure_ascii=False))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# Общий экземпляр: модули пишут в него, main включает и запускает выгрузку
+metrics = Metrics()
@@ -0,0 +1,39 @@
+# pdf_worker.py
+"""Разбор PDF в отдельном процессе.
+
+Процесс запускается через spawn на каждый файл, поэтому модуль нарочно
+не импортирует ничего из бота: чем меньше импортов, тем быстрее старт.
+"""
+import io
+import time
+from multiprocessing.connection import Connection
+
+import PyPDF2
+
+
+def extract_pdf_text(source: bytes | str, max_chars: int, max_pages: int, time_budget: float) -> str:
+    """Извлекает текст из PDF постранично и останавливается, как только набран лимит.
+
+    source — содержимое файла или путь к нему.
+    """
+    deadline = time.monotonic() + time_budget
+    reader = PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+    parts = []
+    total = 0
+    for i, page in enumerate(reader.pages):
+        if i >= max_pages or total >= max_chars or time.monotonic() > deadline:
+            break
+        chunk = page.extract_text() or ""
+        parts.append(chunk)
+        total += len(chunk) + 1
+    return " ".join(parts)[:max_chars]
+
+
+def run(conn: Connection, source: bytes | str, max_chars: int, max_pages: int, time_budget: float):
+    """Точка входа процесса: в conn уходит (True, текст) или (False, описание ошибки)."""
+    try:
+        conn.send((True, extract_pdf_text(source, max_chars, max_pages, time_budget)))
+    except Exception as e:
+        conn.send((False, str(e) or type(e).__name__))
+    finally:
+        conn.close()
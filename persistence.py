@@ -0,0 +1,155 @@
+# persistence.py
+import asyncio
+import json
+import logging
+from datetime import date, datetime
+from typing import Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    # datetime — подкласс date: проверяем его первым, иначе время потеряется
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Не сериализуется: {type(value).__name__}")
+
+
+def _decode(obj: dict):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=_encode, ensure_ascii=False, separators=(',', ':'))
+
+
+def dump_user_data(data: dict) -> Optional[str]:
+    if not data:
+        return None
+    try:
+        return _dumps(data)
+    except (TypeError, ValueError):
+        pass
+    # Что-то не сериализуется — сохраняем остальное, а не теряем всего пользователя
+    kept = {}
+    for key, value in data.items():
+        try:
+            _dumps({key: value})
+        except (TypeError, ValueError) as e:
+            logger.warning(f"user_data[{key!r}] не сохраняется: {e}")
+            continue
+        kept[key] = value
+    return _dumps(kept) if kept else None
+
+
+# Ключи диалогов до перехода на flows.py: шаг хранился строкой в 'waiting',
+# а промежуточные значения — отдельными ключами
+LEGACY_DIALOG_KEYS = (
+    'waiting', 'is_edit_mode', 'text_mode', 'post_type', 'text_prompt', 'image_prompt',
+    'edit_text', 'plan_theme', 'plan_period', 'plan_start', 'plan_end',
+)
+
+
+def load_user_data(raw: str) -> dict:
+    data = json.loads(raw, object_hook=_decode)
+    if 'waiting' in data:
+        # Старый незаконченный диалог не переносим — пользователь начнёт с меню
+        for key in LEGACY_DIALOG_KEYS:
+            data.pop(key, None)
+    return data
+
+
+class SQLitePersistence(BasePersistence):
+    """Сохраняет context.user_data в nco_data.db, чтобы перезапуск не сбрасывал диалоги.
+
+    PTB раз в update_interval секунд передаёт сюда только изменившихся
+    пользователей; они копятся в памяти и пишутся одной транзакцией.
+    Пустой user_data (после clear()) удаляет запись.
+    База читается только при старте, refresh_* ничего не делают — рассчитано
+    на один процесс бота (см. acquire_instance_lock в main.py).
+    """
+
+    def __init__(self, database: Database, update_interval: float = 30):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = database
+        self._dirty: dict[int, Optional[str]] = {}
+        self._write_task: Optional[asyncio.Task] = None
+
+    def _schedule_write(self):
+        # Все update_user_data одного цикла успевают попасть в пачку до старта записи
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_dirty())
+
+    async def _write_dirty(self):
+        while self._dirty:
+            batch, self._dirty = self._dirty, {}
+            await self.db.save_user_states(batch)
+
+    # ── user_data ────────────────────────────────────────────────────
+    async def get_user_data(self) -> dict[int, dict]:
+        rows = await self.db.load_user_states()
+        return {user_id: load_user_data(raw) for user_id, raw in rows.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._dirty[user_id] = dump_user_data(data)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty[user_id] = None
+        self._schedule_write()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_dirty()
+
+    # ── не используется: храним только user_data ─────────────────────
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
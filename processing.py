@@ -0,0 +1,75 @@
+# processing.py
+import asyncio
+from typing import Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from telegram.request import HTTPXRequest
+
+from locks import UserLockRegistry
+from metrics import metrics
+from scheduler import requester
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, сохраняя порядок внутри одного пользователя.
+
+    Обновления разных пользователей идут одновременно (до max_concurrent_updates),
+    а обновления одного пользователя (или чата, если пользователя нет) —
+    строго друг за другом, в порядке поступления.
+
+    Семафор PTB здесь ограничивает max_pending — обновления в работе вместе
+    с теми, что ждут своей очереди. Слот обработчика (max_concurrent_updates)
+    обновление берёт уже после блокировки пользователя, поэтому пользователь
+    с десятками сообщений держит один слот, а не все.
+    """
+
+    def __init__(self, max_concurrent_updates: int, locks: Optional[UserLockRegistry] = None,
+                 max_pending: int = 1000):
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self.locks = locks or UserLockRegistry()
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+
+    @staticmethod
+    def ordering_key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        if isinstance(update, Update):
+            # Планировщик ИИ делит квоты по пользователю и чату, от имени которых идёт запрос
+            requester.set((update.effective_user.id if update.effective_user else None,
+                           update.effective_chat.id if update.effective_chat else None))
+        key = self.ordering_key(update)
+        # Полное время обновления: ожидание своей очереди + обработчик
+        with metrics.timer('update'):
+            if key is None:
+                async with self._slots:
+                    await coroutine
+                return
+            async with self.locks.hold(key):
+                async with self._slots:
+                    await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый вызов Bot API; метка — имя метода."""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        with metrics.timer('telegram', method=api_method):
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        if code >= 400:
+            metrics.inc('errors', source='telegram', method=api_method)
+        return code, payload
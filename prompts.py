@@ -0,0 +1,176 @@
+# prompts.py
+from string import Formatter
+from typing import Optional
+
+from cache import LRUCache
+
+
+# Грубая оценка для русского текста у YandexGPT: ~3 символа на токен.
+# Точный подсчёт — сетевой вызов tokenize, для бюджета хватает оценки с запасом.
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1 if text else 0
+
+
+def fit_to_budget(text: str, max_tokens: int) -> str:
+    """Обрезает текст под бюджет токенов, стараясь закончить на границе предложения."""
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    # Ищем конец предложения в последней пятой части, чтобы не рвать фразу
+    boundary = max(cut.rfind(sep) for sep in (". ", "! ", "? ", "\n"))
+    if boundary >= max_chars * 4 // 5:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + " […]"
+
+
+class Prompt(str):
+    """Готовый промт: обычная строка с посчитанным числом токенов."""
+
+    tokens: int
+
+    def __new__(cls, text: str):
+        obj = super().__new__(cls, text)
+        obj.tokens = estimate_tokens(text)
+        return obj
+
+
+class PromptTemplate:
+    """Шаблон в синтаксисе str.format, разобранный один раз при загрузке."""
+
+    __slots__ = ("source", "_parts")
+
+    def __init__(self, source: str):
+        self.source = source
+        # Пары (литерал, имя поля или None)
+        self._parts = tuple(
+            (literal, field)
+            for literal, field, _, _ in Formatter().parse(source)
+        )
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+    def partial(self, **values) -> "PromptTemplate":
+        """Подставляет известные заранее поля (например, системный промт)."""
+        def escape(text: str) -> str:
+            return text.replace("{", "{{").replace("}", "}}")
+
+        source = []
+        for literal, field in self._parts:
+            source.append(escape(literal))
+            if field is not None:
+                source.append(escape(str(values[field])) if field in values else "{" + field + "}")
+        return PromptTemplate("".join(source))
+
+
+# ── ШАБЛОНЫ ──────────────────────────────────────────────────────────
+NCO_CONTEXT = PromptTemplate(
+    "Информация об НКО:\n"
+    "* Название: {name}\n"
+    "* Деятельность: {activities}\n"
+    "* Аудитория: {audience}\n"
+    "* Сайт: {website}\n\n"
+)
+
+TEXT = PromptTemplate("{system}\n\n{context}{style_hint}Запрос: {user_prompt}")
+
+EDIT = PromptTemplate(
+    "{instruction}\n\n{text}\n\n"
+    "Результатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\n"
+    "Исправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\n"
+    "Пиши об исправленных ошибках в самом конце ответа\n"
+    "Отделяй разделы с помощью эмодзи и при перечислении используй цифры."
+)
+
+EDIT_INSTRUCTIONS = {
+    "Увеличить текст": "Расширь этот текст для соцсетей НКО, добавь детали, эмоции, сделай ярче и с призывом к действию:",
+    "Сократи текст": "Сократи этот текст для соцсетей НКО, сохрани суть, сделай ярче и с призывом:",
+    "Исправить ошибки": "Исправь орфографические, грамматические, логические и речевые ошибки в этом тексте.",
+    "Перефразировать": "Перефразируй этот текст для соцсетей НКО, сохрани смысл, сделай ярче, человечнее, с призывом:",
+}
+EDIT_STYLE_INSTRUCTION = PromptTemplate("Перепиши этот текст в {style_name} стиле для НКО, сделай ярко, с призывом:")
+EDIT_DEFAULT_INSTRUCTION = "Отредактируй этот текст для соцсетей НКО. Сделай ярче, человечнее, с призывом:"
+
+PLAN = PromptTemplate(
+    "{system}\n\n"
+    "{context}"
+    "{theme_hint}"
+    "Составь контент-план на {period_desc} с частотой «{frequency}», начиная с {start}.\n"
+    "{part_hint}"
+    "Даты публикаций: {dates}\n"
+    "Для каждой даты: 1 идея поста (тип + краткое описание). Всего {count} идей.\n"
+    "Формат: [дд.мм] — Тип: Краткое описание (1-2 предложения)"
+)
+
+
+class PromptBuilder:
+    """Собирает промты из шаблонов, скомпилированных один раз.
+
+    Системный промт вшивается в шаблоны при создании, блок «Информация об НКО»
+    кэшируется по содержимому профиля — изменился профиль, изменился и ключ.
+    """
+
+    def __init__(self, system_prompt: str, context_cache_size: int = 4096):
+        self.text_template = TEXT.partial(system=system_prompt)
+        self.plan_template = PLAN.partial(system=system_prompt)
+        self._contexts = LRUCache(context_cache_size)
+
+    def nco_context(self, nco_info: Optional[dict]) -> str:
+        if not nco_info or not any(nco_info.values()):
+            return ""
+        key = (nco_info.get('name', ''), nco_info.get('activities', ''),
+               nco_info.get('audience', ''), nco_info.get('website', ''))
+        block = self._contexts.get(key)
+        if block is None:
+            block = NCO_CONTEXT.render(name=key[0], activities=key[1], audience=key[2], website=key[3])
+            self._contexts.set(key, block)
+        return block
+
+    def text(self, user_prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None) -> Prompt:
+        return Prompt(self.text_template.render(
+            context=self.nco_context(nco_info),
+            style_hint=f"Стиль: {style}. " if style else "",
+            user_prompt=user_prompt
+        ))
+
+    def user_text_budget(self, context_tokens: int, output_tokens: int,
+                         nco_info: Optional[dict] = None, edit: bool = False) -> int:
+        """Сколько токенов остаётся на текст пользователя после системного промта,
+        блока НКО, обёртки запроса и резерва под ответ модели."""
+        overhead = self.text("", nco_info, style="официально-деловой").tokens
+        if edit:
+            overhead += estimate_tokens(EDIT.render(instruction=EDIT_DEFAULT_INSTRUCTION, text=""))
+        return max(0, context_tokens - output_tokens - overhead)
+
+    @staticmethod
+    def edit_request(text: str, action: str, style: Optional[str] = None) -> str:
+        """Запрос на редактирование; дальше он оборачивается в text()."""
+        # Кнопки приходят с эмодзи впереди: «📉 Сократи текст»
+        name = action if action in EDIT_INSTRUCTIONS or action == "Изменить стиль" else action.split(" ", 1)[-1]
+        if name == "Изменить стиль":
+            instruction = EDIT_STYLE_INSTRUCTION.render(style_name="без стиля" if style is None else style)
+        else:
+            instruction = EDIT_INSTRUCTIONS.get(name, EDIT_DEFAULT_INSTRUCTION)
+        return EDIT.render(instruction=instruction, text=text)
+
+    def plan(self, nco_info: Optional[dict], theme: Optional[str], period_desc: str, frequency: str,
+             start: str, dates: str, count: int, part_hint: str = "") -> Prompt:
+        return Prompt(self.plan_template.render(
+            context=self.nco_context(nco_info),
+            theme_hint=f"Тема: {theme}\n" if theme else "",
+            period_desc=period_desc,
+            frequency=frequency,
+            start=start,
+            part_hint=part_hint,
+            dates=dates,
+            count=count
+        ))
@@ -0,0 +1,49 @@
+# router.py
+from typing import Callable, Iterable, Optional, Union
+
+from flows import CLEAR, HOME, MACHINE, SKIP
+
+
+# ── КНОПКИ ГЛАВНОГО МЕНЮ ─────────────────────────────────────────────
+BACK_BUTTON = HOME
+IDLE_BUTTONS = (SKIP, CLEAR)
+NCO_BUTTONS = ("➕ Предоставить информацию об НКО", "👁️ Просмотреть информацию об НКО")
+SECTION_BUTTONS = {
+    "📝 Генерация текста": 'text',
+    "🎨 Генерация изображения": 'image',
+    "✏️ Редактор текста": 'edit',
+    "📅 Контент-план": 'plan',
+}
+
+
+class Router:
+    """Таблица маршрутов для текстовых сообщений, собранная один раз при старте.
+
+    Порядок проверки: кнопки, работающие всегда (главное меню), затем
+    обработчик раздела текущего шага (см. flows.py), затем кнопки, имеющие
+    смысл только вне диалога, и наконец маршрут по умолчанию.
+    Каждая проверка — один поиск в dict.
+    """
+
+    def __init__(self, default: Callable):
+        self.default = default
+        self.buttons: dict[str, Callable] = {}
+        self.idle_buttons: dict[str, Callable] = {}
+        self.states: dict[int, Callable] = {}
+
+    def on_button(self, texts: Union[str, Iterable[str]], route: Callable, idle_only: bool = False):
+        table = self.idle_buttons if idle_only else self.buttons
+        for text in ((texts,) if isinstance(texts, str) else texts):
+            table[text] = route
+
+    def on_flow(self, flow: str, route: Callable):
+        for state in MACHINE.flows[flow].states:
+            self.states[state.id] = route
+
+    def resolve(self, text: Optional[str], state: Optional[int]) -> Callable:
+        route = self.buttons.get(text)
+        if route is not None:
+            return route
+        if state is not None:
+            return self.states.get(state, self.default)
+        return self.idle_buttons.get(text, self.default)
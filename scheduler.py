@@ -0,0 +1,201 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from cache import LRUCache
+
+
+# Кто сейчас обращается к ИИ: (user_id, chat_id). Выставляется при обработке
+# обновления и в фоновых задачах; задачи, созданные внутри, наследуют значение.
+requester: ContextVar[tuple[Optional[int], Optional[int]]] = ContextVar('requester', default=(None, None))
+
+# Условная «цена» запроса: сколько он занимает модель и расходует квоту.
+# Дешёвые правки обгоняют минутную генерацию картинок.
+COSTS = {
+    'edit': 1.0,
+    'text': 2.0,
+    'plan': 2.0,
+    'image': 10.0,
+}
+
+
+THROTTLED_TEXT = "Слишком много запросов подряд. Подожди {seconds} с и попробуй снова."
+
+
+class Throttled(Exception):
+    """Квота исчерпана: запрос отклонён, повторить можно через retry_after секунд.
+
+    Текст исключения можно показать пользователю.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(THROTTLED_TEXT.format(seconds=max(1, round(retry_after))))
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, cost: float) -> float:
+        """Через сколько секунд в корзине наберётся cost; 0 — можно сейчас."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Запрос дороже всего запаса иначе не прошёл бы никогда
+        need = min(cost, self.burst)
+        return (need - self.tokens) / self.rate if self.tokens < need else 0.0
+
+    def take(self, cost: float):
+        # В минус не уходим: долг не копится, сколько бы запросов ни пришло
+        self.tokens = max(0.0, self.tokens - cost)
+
+
+class FairScheduler:
+    """Общий планировщик запросов к YandexGPT и yandex-art.
+
+    Один экземпляр разделяют TextService и ImageService. Запросы сначала
+    проходят через корзины токенов пользователя и чата: если квоты не хватает,
+    запрос сразу отклоняется с Throttled (никто не спит, держа слоты и
+    блокировки), а пользователь до конца срока попадает в retry_after():
+    по нему обработчики разделов сразу отвечают «подожди N с» на кнопки,
+    которые запускают генерацию. Прошедшие запросы ждут свободного слота
+    в очереди со взвешенным справедливым обслуживанием: у каждого
+    пользователя своё виртуальное время, и тот, кто уже много потратил,
+    пропускает вперёд остальных.
+    """
+
+    def __init__(self, max_concurrent: int, user_rate: float = 0.5, user_burst: float = 20.0,
+                 chat_rate: float = 1.0, chat_burst: float = 40.0, buckets_size: int = 10000):
+        self.max_concurrent = max_concurrent
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._user_buckets = LRUCache(buckets_size)
+        self._chat_buckets = LRUCache(buckets_size)
+
+        self.in_flight = 0
+        self._queue: list = []                    # куча (метка, seq, future, kind)
+        self._seq = itertools.count()
+        self._vtime = 0.0                         # метка последнего запущенного запроса
+        self._finish: dict = {}                   # последняя метка каждого пользователя
+
+        self.waiting = {kind: 0 for kind in COSTS}
+        self.throttled = 0
+        self.wait_total = {kind: 0.0 for kind in COSTS}
+        self.wait_max = {kind: 0.0 for kind in COSTS}
+        self.started = {kind: 0 for kind in COSTS}
+
+    @asynccontextmanager
+    async def slot(self, kind: str):
+        user_id, chat_id = requester.get()
+        cost = COSTS.get(kind, COSTS['text'])
+        self._throttle(user_id, chat_id, cost)
+
+        began = time.monotonic()
+        await self._acquire(user_id, kind, cost)
+        self._record_wait(kind, time.monotonic() - began)
+        try:
+            yield
+        finally:
+            self._release()
+
+    # ── КОРЗИНЫ ТОКЕНОВ ──────────────────────────────────────────────
+    def _bucket(self, buckets: LRUCache, key: int, rate: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key, count=False)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            buckets.set(key, bucket)
+        return bucket
+
+    def _throttle(self, user_id: Optional[int], chat_id: Optional[int], cost: float):
+        user_bucket = None
+        buckets = []
+        if user_id is not None and self.user_rate > 0:
+            user_bucket = self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst)
+            buckets.append(user_bucket)
+        # В личке чат совпадает с пользователем — отдельная корзина только у групп
+        if chat_id is not None and chat_id != user_id and self.chat_rate > 0:
+            buckets.append(self._bucket(self._chat_buckets, chat_id, self.chat_rate, self.chat_burst))
+        delay = max((bucket.wait_time(cost) for bucket in buckets), default=0.0)
+        if delay > 0:
+            # Ничего не списываем: отклонённый запрос квоту не тратит
+            self.throttled += 1
+            if user_bucket is not None:
+                user_bucket.blocked_until = time.monotonic() + delay
+            raise Throttled(delay)
+        for bucket in buckets:
+            bucket.take(cost)
+
+    def retry_after(self, user_id: int) -> float:
+        """Сколько секунд ещё действует отказ, который пользователь уже получил."""
+        bucket = self._user_buckets.get(user_id, count=False)
+        if bucket is None:
+            return 0.0
+        return max(0.0, bucket.blocked_until - time.monotonic())
+
+    # ── СПРАВЕДЛИВАЯ ОЧЕРЕДЬ ─────────────────────────────────────────
+    async def _acquire(self, flow: Optional[int], kind: str, cost: float):
+        tag = max(self._vtime, self._finish.get(flow, 0.0)) + cost
+        self._finish[flow] = tag
+        if self.in_flight < self.max_concurrent and not self._queue:
+            self._start(tag, kind)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (tag, next(self._seq), future, kind))
+        self.waiting[kind] = self.waiting.get(kind, 0) + 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но забрать его некому — передаём дальше
+                self._release()
+            raise
+        finally:
+            self.waiting[kind] -= 1
+
+    def _start(self, tag: float, kind: str):
+        self.in_flight += 1
+        self._vtime = tag
+        self.started[kind] = self.started.get(kind, 0) + 1
+        if len(self._finish) > 4 * self.max_concurrent + 1000:
+            # Метки не новее текущего времени ничего не дают — забываем их
+            self._finish = {flow: t for flow, t in self._finish.items() if t > self._vtime}
+
+    def _release(self):
+        self.in_flight -= 1
+        while self._queue and self.in_flight < self.max_concurrent:
+            tag, _, future, kind = heapq.heappop(self._queue)
+            if future.done():
+                continue  # ожидающий отменён
+            self._start(tag, kind)
+            future.set_result(None)
+
+    def _record_wait(self, kind: str, waited: float):
+        self.wait_total[kind] = self.wait_total.get(kind, 0.0) + waited
+        if waited > self.wait_max.get(kind, 0.0):
+            self.wait_max[kind] = waited
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'waiting': sum(self.waiting.values()),
+            'waiting_by_kind': dict(self.waiting),
+            'max_concurrent': self.max_concurrent,
+            'throttled': self.throttled,
+            'wait_avg': {kind: self.wait_total[kind] / n for kind, n in self.started.items() if n},
+            'wait_max': dict(self.wait_max),
+        }
@@ -0,0 +1,36 @@
+# tests/test_cache.py
+import asyncio
+import time
+
+import cache
+from cache import LRUCache
+from db import Database
+
+
+def test_set_with_age_keeps_original_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(ttl=60)
+    lru.set('fresh', 'a')
+    lru.set('loaded', 'b', age=50)
+
+    now[0] += 20
+    assert lru.get('fresh') == 'a'
+    assert lru.get('loaded') is None
+
+
+def test_attachment_text_reports_its_age(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'test.db'))
+        try:
+            await db.save_attachment_text('file', 'текст', max_age=3600, max_rows=10)
+            with db._conn as conn:
+                conn.execute("UPDATE attachment_text SET created_at = ?", (time.time() - 100,))
+            text, age = await db.get_attachment_text('file', max_age=3600)
+            assert text == 'текст'
+            assert 100 <= age < 110
+            assert await db.get_attachment_text('file', max_age=50) is None
+        finally:
+            await db.close()
+
+    asyncio.run(scenario())
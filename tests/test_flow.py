@@ -0,0 +1,84 @@
+# tests/test_flow.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("yandex_cloud_ml_sdk")
+
+from flows import BACK, dialog  # noqa: E402
+from handlers.handlers_text_edit import TextEditHandler  # noqa: E402
+from scheduler import FairScheduler, Throttled, requester  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class FakeTextService:
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.calls = 0
+        self.use_cache = []
+
+    async def edit_text_with_action(self, *args, use_cache=True, **kwargs):
+        self.calls += 1
+        self.use_cache.append(use_cache)
+        return "готово"
+
+
+def test_throttled_user_is_refused_generation_but_can_navigate():
+    async def scenario():
+        limiter = FairScheduler(max_concurrent=2, user_rate=0.01, user_burst=1.0)
+        requester.set((1, 1))
+        async with limiter.slot('edit'):
+            pass
+        with pytest.raises(Throttled):
+            await limiter.slot('edit').__aenter__()
+
+        ts = FakeTextService(limiter)
+        handler = TextEditHandler(ts)
+        user_data = {}
+        dialog(user_data).start('edit_text')
+        dialog(user_data).go('edit_action', text="Текст поста")
+        context = SimpleNamespace(user_data=user_data)
+
+        message = FakeMessage()
+        update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=1))
+        assert await handler.handle(update, context, "✅ Исправить ошибки")
+        assert ts.calls == 0
+        assert "Подожди" in message.replies[-1]
+        assert dialog(user_data).name == 'edit_action'
+
+        # Навигация генерацию не запускает и проходит как обычно
+        assert await handler.handle(update, context, BACK)
+        assert dialog(user_data).name == 'edit_text'
+
+    asyncio.run(scenario())
+
+
+def test_repeated_edit_after_result_bypasses_cache(monkeypatch):
+    import handlers.handlers_nco
+    monkeypatch.setattr(handlers.handlers_nco, 'get_main_keyboard', lambda has_data: None)
+
+    async def scenario():
+        requester.set((1, 1))
+        ts = FakeTextService(FairScheduler(max_concurrent=2))
+        handler = TextEditHandler(ts)
+        user_data = {}
+        context = SimpleNamespace(user_data=user_data)
+        update = SimpleNamespace(message=FakeMessage(), effective_user=SimpleNamespace(id=1))
+
+        for source in ("Текст поста", "Текст поста", "Другой текст"):
+            dialog(user_data).start('edit_text')
+            dialog(user_data).go('edit_action', text=source)
+            assert await handler.handle(update, context, "✅ Исправить ошибки")
+
+        assert ts.use_cache == [True, False, True]
+
+    asyncio.run(scenario())
@@ -0,0 +1,30 @@
+# tests/test_image_cache.py
+import asyncio
+import os
+
+from image_cache import ImageCache
+
+
+def test_file_id_hit_protects_image_from_eviction(tmp_path):
+    async def scenario():
+        cache = ImageCache(str(tmp_path), max_bytes=25)
+        await cache.put('a', b'x' * 10)
+        await cache.set_file_id('a', 'file-a')
+        await cache.put('b', b'x' * 10)
+        assert cache.get_file_id('a') == 'file-a'
+        await cache.put('c', b'x' * 10)
+        assert cache.get_file_id('a') == 'file-a'
+        assert cache.get_file_id('b') is None
+
+    asyncio.run(scenario())
+
+
+def test_orphan_file_ids_are_removed_on_load(tmp_path):
+    (tmp_path / 'kept.img').write_bytes(b'x')
+    (tmp_path / 'kept.fid').write_text('file-kept', encoding='utf-8')
+    (tmp_path / 'gone.fid').write_text('file-gone', encoding='utf-8')
+
+    cache = ImageCache(str(tmp_path))
+    assert cache.get_file_id('kept') == 'file-kept'
+    assert cache.get_file_id('gone') is None
+    assert not os.path.exists(tmp_path / 'gone.fid')
@@ -0,0 +1,42 @@
+# tests/test_persistence.py
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from db import Database  # noqa: E402
+from persistence import SQLitePersistence  # noqa: E402
+
+
+def test_user_data_round_trip_keeps_dates_and_drops_only_bad_keys(tmp_path):
+    when = datetime(2024, 5, 17, 14, 30, 5)
+    user_data = {
+        'state': 41,
+        'slots': ["Весенний сбор", "неделя", date(2024, 5, 20), None],
+        'when': when,
+        'bad': object(),
+    }
+
+    async def scenario():
+        db = Database(str(tmp_path / 'test.db'))
+        try:
+            persistence = SQLitePersistence(db)
+            await persistence.update_user_data(1, user_data)
+            await persistence.flush()
+
+            # Новый экземпляр — как после перезапуска бота
+            loaded = await SQLitePersistence(db).get_user_data()
+        finally:
+            await db.close()
+        return loaded
+
+    loaded = asyncio.run(scenario())
+    assert set(loaded) == {1}
+    restored = loaded[1]
+    assert set(restored) == {'state', 'slots', 'when'}
+    assert isinstance(restored['when'], datetime)
+    assert restored['when'] == when
+    assert restored['slots'] == ["Весенний сбор", "неделя", date(2024, 5, 20), None]
+    assert restored['state'] == 41
@@ -0,0 +1,47 @@
+# tests/test_processing.py
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+
+from processing import UserOrderedUpdateProcessor  # noqa: E402
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, first_name="u", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat,
+                      from_user=user, text=f"сообщение {update_id}")
+    return Update(update_id=update_id, message=message)
+
+
+def test_flooding_user_does_not_block_others():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=2)
+        release = asyncio.Event()
+        handled = []
+
+        async def slow(i):
+            await release.wait()
+            handled.append(("flood", i))
+
+        async def fast():
+            handled.append(("other", 0))
+
+        # Пользователь 1 шлёт втрое больше сообщений, чем слотов
+        flood = [asyncio.create_task(processor.process_update(make_update(i, 1), slow(i))) for i in range(6)]
+        await asyncio.sleep(0)
+        other = asyncio.create_task(processor.process_update(make_update(100, 2), fast()))
+
+        await asyncio.wait_for(other, timeout=1)
+        assert handled == [("other", 0)]
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*flood), timeout=1)
+        assert [i for who, i in handled if who == "flood"] == list(range(6))
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+# tests/test_scheduler.py
+import asyncio
+
+import pytest
+
+from scheduler import FairScheduler, Throttled, requester
+
+
+def test_exhausted_quota_rejects_without_debt():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrent=4, user_rate=0.5, user_burst=4.0)
+        requester.set((1, 1))
+        for _ in range(2):
+            async with scheduler.slot('text'):
+                pass
+
+        # Отказ приходит сразу, а не после сна внутри слота
+        with pytest.raises(Throttled) as rejected:
+            await asyncio.wait_for(scheduler.slot('text').__aenter__(), timeout=0.1)
+        assert 0 < rejected.value.retry_after <= 4.0
+        assert scheduler.retry_after(1) > 0
+        assert scheduler.retry_after(2) == 0
+
+        # Повторные отказы не копят долг: ожидание не растёт
+        for _ in range(10):
+            with pytest.raises(Throttled) as again:
+                await scheduler.slot('text').__aenter__()
+        assert again.value.retry_after <= rejected.value.retry_after
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
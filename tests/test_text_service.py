@@ -0,0 +1,153 @@
+# tests/test_text_service.py
+import asyncio
+import re
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("yandex_cloud_ml_sdk")
+
+import text_service  # noqa: E402
+from config import Config  # noqa: E402
+from scheduler import FairScheduler  # noqa: E402
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = 0
+
+    def configure(self, **kwargs):
+        return self
+
+    async def run(self, prompt):
+        self.calls += 1
+        return SimpleNamespace(alternatives=[SimpleNamespace(text=f"ответ {self.calls}")])
+
+    async def run_stream(self, prompt):
+        text = ""
+        for word in ("раз", "два", "три"):
+            await asyncio.sleep(0)
+            text += word + " "
+            yield SimpleNamespace(alternatives=[SimpleNamespace(text=text)])
+
+
+class PlanModel(FakeModel):
+    """Отвечает строкой плана на дату части; вторая часть не укладывается в таймаут."""
+
+    TOPICS = ("субботник в парке", "ярмарка поделок", "концерт во дворе")
+
+    async def run(self, prompt):
+        self.calls += 1
+        part = int(re.search(r"часть (\d+) из", prompt).group(1))
+        if part == 2:
+            await asyncio.sleep(1)
+        return SimpleNamespace(alternatives=[SimpleNamespace(text=f"0{part}.03 — {self.TOPICS[part - 1]}")])
+
+
+def make_service(monkeypatch, model):
+    sdk = SimpleNamespace(setup_default_logging=lambda: None,
+                          models=SimpleNamespace(completions=lambda name: model))
+    monkeypatch.setattr(text_service, "AsyncYCloudML", lambda **kwargs: sdk)
+    config = Config(TELEGRAM_BOT_TOKEN="t", YANDEX_FOLDER_ID="f", YANDEX_OAUTH_TOKEN="o", YANDEX_IAM_TOKEN="i")
+    return text_service.TextService(config)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    model = FakeModel()
+    return make_service(monkeypatch, model), model
+
+
+def test_new_posts_are_not_cached(service):
+    ts, model = service
+
+    async def scenario():
+        first = await ts.generate_text("Субботник в парке")
+        second = await ts.generate_text("Субботник в парке")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first != second
+    assert model.calls == 2
+
+
+def test_edits_are_cached(service):
+    ts, model = service
+
+    async def scenario():
+        first = await ts.edit_text_with_action("Текст поста", "✅ Исправить ошибки")
+        second = await ts.edit_text_with_action("Текст поста", "✅ Исправить ошибки")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert model.calls == 1
+
+
+def test_stream_releases_ai_slot_before_consumer_finishes(service):
+    ts, model = service
+
+    async def scenario():
+        chunks = ts.stream_text("Субботник в парке")
+        first = await chunks.__anext__()
+        # Потребитель «правит сообщение», а модель тем временем дописывает ответ
+        for _ in range(20):
+            await asyncio.sleep(0)
+        in_flight = ts.limiter.in_flight
+        rest = [text async for text in chunks]
+        return first, rest, in_flight
+
+    first, rest, in_flight = asyncio.run(scenario())
+    assert first == "раз "
+    assert rest == ["раз два три "]
+    assert in_flight == 0
+
+
+def test_merge_marks_failed_chunks_and_drops_near_duplicates():
+    march = [date(2026, 3, day) for day in range(1, 7)]
+    plan = text_service.merge_plan_chunks([
+        (march[0:2], "01.03 — Субботник в парке с волонтёрами\n02.03 — Ярмарка поделок"),
+        (march[2:4], None),
+        (march[4:6], "05.03 — субботник в парке с волонтёром!\n06.03 — Концерт во дворе"),
+    ])
+    assert plan.splitlines() == [
+        "01.03 — Субботник в парке с волонтёрами",
+        "02.03 — Ярмарка поделок",
+        "⚠️ Не удалось составить план на даты 03.03–04.03",
+        "06.03 — Концерт во дворе",
+    ]
+
+
+def test_plan_with_timed_out_chunk(monkeypatch):
+    ts = make_service(monkeypatch, PlanModel())
+    ts.plan_chunk_size = 1
+    ts.timeout = 0.05
+
+    plan = asyncio.run(ts.generate_content_plan(
+        "custom", "1 раз в день", start_date=date(2026, 3, 1), end_date=date(2026, 3, 3)
+    ))
+    assert plan.splitlines() == [
+        "01.03 — субботник в парке",
+        "⚠️ Не удалось составить план на даты 02.03",
+        "03.03 — концерт во дворе",
+    ]
+
+
+def test_stream_timeout_does_not_count_slot_wait(service):
+    ts, model = service
+    ts.limiter = FairScheduler(max_concurrent=1)
+    ts.timeout = 0.1
+
+    async def hold_slot():
+        async with ts.limiter.slot('text'):
+            await asyncio.sleep(0.3)
+
+    async def scenario():
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        texts = [text async for text in ts.stream_text("Субботник в парке")]
+        await holder
+        return texts
+
+    assert asyncio.run(scenario())[-1] == "раз два три "
@@ -1,70 +1,318 @@
 # text_service.py
-from yandex_cloud_ml_sdk import YCloudML
-from typing import Optional
+from yandex_cloud_ml_sdk import AsyncYCloudML
+from typing import AsyncIterator, Optional
 from datetime import datetime, timedelta
 from config import Config
+from cache import LRUCache
+from metrics import metrics
+from scheduler import FairScheduler, Throttled
+from prompts import Prompt, PromptBuilder, fit_to_budget
+import asyncio
+import hashlib
 import re
 
 
+TIMEOUT_TEXT = "Сервис генерации сейчас перегружен и не ответил вовремя. Попробуй ещё раз через минуту."
+
+# Конец потока в очереди TextService._read_stream
+_STREAM_END = object()
+
+PLAN_LINE_RE = re.compile(r'^\W*\[?(\d{1,2}\.\d{1,2})\]?\s*[—–-]?\s*(.*)$')
+# Доля общих слов, при которой две идеи плана считаются одной
+PLAN_DUPLICATE_SHARE = 0.8
+
+
+class GenerationError(Exception):
+    """Модель не дала ответа; текст исключения можно показать пользователю."""
+
+
+class GenerationTimeout(GenerationError):
+    def __init__(self):
+        super().__init__(TIMEOUT_TEXT)
+
+
+class GenerationThrottled(GenerationError):
+    def __init__(self, retry_after: float):
+        super().__init__(str(Throttled(retry_after)))
+
+
+def _idea_words(idea: str) -> frozenset:
+    # Грубые основы слов: «волонтёры» и «волонтёров» считаются одним словом
+    return frozenset(word[:6] for word in re.findall(r'\w+', idea.lower()) if len(word) > 2)
+
+
+def _dates_range(dates: list) -> str:
+    first, last = dates[0].strftime('%d.%m'), dates[-1].strftime('%d.%m')
+    return first if first == last else f"{first}–{last}"
+
+
+def merge_plan_chunks(chunks: list[tuple[list, Optional[str]]]) -> str:
+    """Склеивает части контент-плана по порядку дат и убирает повторяющиеся идеи.
+
+    chunks — готовые части: (даты части, текст). Часть без текста (модель не
+    ответила) или без строк с датами (ответ не по формату) заменяется пометкой
+    с её датами. Повтором считается идея, почти совпадающая по словам с уже взятой.
+    """
+    lines = []
+    seen: list[frozenset] = []
+    for dates, chunk in chunks:
+        ideas = [line.strip() for line in (chunk or "").splitlines() if PLAN_LINE_RE.match(line.strip())]
+        if not ideas:
+            lines.append(f"⚠️ Не удалось составить план на даты {_dates_range(dates)}")
+            continue
+        for line in ideas:
+            words = _idea_words(PLAN_LINE_RE.match(line).group(2))
+            if words and any(len(words & other) >= PLAN_DUPLICATE_SHARE * len(words | other) for other in seen):
+                continue
+            seen.append(words)
+            lines.append(line)
+    return "\n".join(lines)
+
+
 class TextService:
-    def __init__(self, config: Config):
-        self.sdk = YCloudML(
+    def __init__(self, config: Config, limiter: Optional[FairScheduler] = None):
+        self.sdk = AsyncYCloudML(
             folder_id=config.YANDEX_FOLDER_ID,
             auth=config.YANDEX_OAUTH_TOKEN,
         )
         self.sdk.setup_default_logging()
 
         self.model = self.sdk.models.completions('yandexgpt')
-        self.model = self.model.configure(temperature=0.7, max_tokens=1500)
+        self.model = self.model.configure(temperature=0.7, max_tokens=config.TEXT_MAX_TOKENS)
+        self.max_tokens = config.TEXT_MAX_TOKENS
+        self.context_tokens = config.MODEL_CONTEXT_TOKENS
 
         self.system_prompt = config.AI_SYSTEM_PROMPT
+        self.prompts = PromptBuilder(config.AI_SYSTEM_PROMPT)
+        self.prompt_stats = {'count': 0, 'tokens_total': 0, 'tokens_max': 0}
+        self.timeout = config.TEXT_TIMEOUT
+        self.limiter = limiter or FairScheduler(config.AI_MAX_CONCURRENCY)
 
-    def generate_text(self, user_prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None) -> str:
-        context = ""
-        if nco_info and any(nco_info.values()):
-            context = (
-                f"Информация об НКО:\n"
-                f"* Название: {nco_info.get('name', '')}\n"
-                f"* Деятельность: {nco_info.get('activities', '')}\n"
-                f"* Аудитория: {nco_info.get('audience', '')}\n"
-                f"* Сайт: {nco_info.get('website', '')}\n\n"
-            )
+        self.cache = LRUCache(config.TEXT_CACHE_SIZE, ttl=config.TEXT_CACHE_TTL) if config.TEXT_CACHE_SIZE > 0 else None
+        self.cache_skip_actions = config.TEXT_CACHE_SKIP_ACTIONS
+        self.cache_kinds = config.TEXT_CACHE_KINDS
+
+        self.plan_max_posts = config.PLAN_MAX_POSTS
+        self.plan_chunk_size = config.PLAN_CHUNK_SIZE
+        self.plan_chunk_concurrency = config.PLAN_CHUNK_CONCURRENCY
+
+    @staticmethod
+    def _cache_key(prompt: str) -> str:
+        # Лишние пробелы и переносы не меняют смысла запроса — схлопываем их
+        normalized = " ".join(prompt.split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _measure(self, prompt: str):
+        tokens = getattr(prompt, 'tokens', None)
+        if tokens is None:
+            return
+        self.prompt_stats['count'] += 1
+        self.prompt_stats['tokens_total'] += tokens
+        if tokens > self.prompt_stats['tokens_max']:
+            self.prompt_stats['tokens_max'] = tokens
+
+    async def _run(self, prompt: str, use_cache: bool = True, kind: str = 'text') -> str:
+        self._measure(prompt)
+        key = None
+        if use_cache and self.cache is not None and kind in self.cache_kinds:
+            key = self._cache_key(prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        # Ограничиваем число одновременных запросов и время ожидания каждого,
+        # чтобы один медленный ответ не задерживал остальных пользователей
+        try:
+            async with self.limiter.slot(kind):
+                try:
+                    with metrics.timer('model', model='yandexgpt', kind=kind):
+                        result = await asyncio.wait_for(self.model.run(prompt), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    print(f"[GPT] Таймаут {self.timeout} с")
+                    raise GenerationTimeout() from None
+        except Throttled as e:
+            raise GenerationThrottled(e.retry_after) from None
+        text = result.alternatives[0].text.strip()
+        if key is not None:
+            self.cache.set(key, text)
+        return text
 
-        style_hint = f"Стиль: {style}. " if style else ""
-        full_prompt = f"{self.system_prompt}\n\n{context}{style_hint}Запрос: {user_prompt}"
-
-        result = self.model.run(full_prompt)
-        return result.alternatives[0].text.strip()
-
-    def edit_text_with_action(self, text: str, action: str, nco_info: Optional[dict] = None, style: Optional[str] = None) -> str:
-        if action == "Увеличить текст":
-            prompt = f"Расширь этот текст для соцсетей НКО, добавь детали, эмоции, сделай ярче и с призывом к действию:\n\n{text}\n\nРезультатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\nИсправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\nПиши об исправленных ошибках в самом конце ответа\nОтделяй разделы с помощью эмодзи и при перечислении используй цифры."
-        elif action == "Сократи текст":
-            prompt = f"Сократи этот текст для соцсетей НКО, сохрани суть, сделай ярче и с призывом:\n\n{text}\n\nРезультатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\nИсправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\nПиши об исправленных ошибках в самом конце ответа\nОтделяй разделы с помощью эмодзи и при перечислении используй цифры."
-        elif action == "Исправить ошибки":
-            prompt = f"Исправь орфографические, грамматические, логические и речевые ошибки в этом тексте.\n\n{text}\n\nРезультатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\nИсправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\nПиши об исправленных ошибках в самом конце ответа\nОтделяй разделы с помощью эмодзи и при перечислении используй цифры."
-        elif action == "Перефразировать":
-            prompt = f"Перефразируй этот текст для соцсетей НКО, сохрани смысл, сделай ярче, человечнее, с призывом:\n\n{text}\n\nРезультатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\nИсправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\nПиши об исправленных ошибках в самом конце ответа\nОтделяй разделы с помощью эмодзи и при перечислении используй цифры."
-        elif action == "Изменить стиль":
-            style_name = "без стиля" if style is None else style
-            prompt = f"Перепиши этот текст в {style_name} стиле для НКО, сделай ярко, с призывом:\n\n{text}\n\nРезультатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\nИсправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\nПиши об исправленных ошибках в самом конце ответа\nОтделяй разделы с помощью эмодзи и при перечислении используй цифры."
+    async def _stream(self, prompt: str, use_cache: bool = True, kind: str = 'text') -> AsyncIterator[str]:
+        """Как _run, но отдаёт накопленный текст по мере генерации.
+
+        Ответ модели читает отдельная задача, которая держит слот планировщика
+        только пока идёт генерация. Генератор отдаёт самый свежий текст: пока
+        потребитель правит сообщение в Telegram или ждёт RetryAfter, слот не занят.
+        """
+        self._measure(prompt)
+        key = None
+        if use_cache and self.cache is not None and kind in self.cache_kinds:
+            key = self._cache_key(prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        updates: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(prompt, kind, updates))
+        text = ""
+        try:
+            while True:
+                items = [await updates.get()]
+                while not updates.empty():
+                    items.append(updates.get_nowait())
+                # Потребитель отстал — промежуточные фрагменты ему уже не нужны
+                texts = [item for item in items if isinstance(item, str)]
+                if texts and texts[-1] != text:
+                    text = texts[-1]
+                    yield text
+                end = items[-1]
+                if end is _STREAM_END:
+                    break
+                if isinstance(end, Exception):
+                    raise end
+        finally:
+            reader.cancel()
+        if key is not None and text.strip():
+            self.cache.set(key, text.strip())
+
+    async def _read_stream(self, prompt: str, kind: str, updates: asyncio.Queue):
+        """Читает поток модели в updates; в конце кладёт _STREAM_END или исключение."""
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.limiter.slot(kind):
+                # Как и в _run, таймаут — на ответ модели, а не на ожидание слота
+                started = loop.time()
+                deadline = started + self.timeout
+                first = True
+                stream = self.model.run_stream(prompt).__aiter__()
+                while True:
+                    try:
+                        # Таймаут общий на весь ответ, а не на каждый фрагмент
+                        result = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        print(f"[GPT] Таймаут потока {self.timeout} с")
+                        metrics.inc('errors', source='model', model='yandexgpt', kind=kind)
+                        raise GenerationTimeout() from None
+                    if first:
+                        metrics.observe('model_first_chunk', loop.time() - started, model='yandexgpt', kind=kind)
+                        first = False
+                    updates.put_nowait(result.alternatives[0].text)
+                # Только ожидание модели: правки сообщения идут в другой задаче
+                metrics.observe('model_stream', loop.time() - started, model='yandexgpt', kind=kind)
+        except Throttled as e:
+            updates.put_nowait(GenerationThrottled(e.retry_after))
+        except Exception as e:
+            updates.put_nowait(e)
         else:
-            prompt = f"Отредактируй этот текст для соцсетей НКО. Сделай ярче, человечнее, с призывом:\n\n{text}\n\nРезультатом должен стать отредактированный текст пользователя с указанием, где были допущены ошибки и как их исправлять\nИсправление ошибок - исправление структурных ошибок в тексте и указание на них, а также совет как их избежать в будущем\nПиши об исправленных ошибках в самом конце ответа\nОтделяй разделы с помощью эмодзи и при перечислении используй цифры."
+            updates.put_nowait(_STREAM_END)
+
+    async def generate_text(self, user_prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None,
+                            use_cache: bool = True) -> str:
+        return await self._run(self._text_prompt(user_prompt, nco_info, style), use_cache)
 
-        return self.generate_text(prompt, nco_info)
+    def stream_text(self, user_prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None,
+                    use_cache: bool = True) -> AsyncIterator[str]:
+        return self._stream(self._text_prompt(user_prompt, nco_info, style), use_cache)
 
-    def edit_text(self, text: str, nco_info: Optional[dict] = None) -> str:
-        return self.edit_text_with_action(text, "default", nco_info)
+    def _text_prompt(self, user_prompt: str, nco_info: Optional[dict] = None, style: Optional[str] = None) -> Prompt:
+        return self.prompts.text(user_prompt, nco_info, style)
 
-    def generate_content_plan(
+    def fit_user_text(self, text: str, nco_info: Optional[dict] = None, edit: bool = False) -> str:
+        """Подрезает текст из вложения, чтобы промт с ответом уместился в окно модели."""
+        budget = self.prompts.user_text_budget(self.context_tokens, self.max_tokens, nco_info, edit)
+        fitted = fit_to_budget(text, budget)
+        if len(fitted) < len(text):
+            print(f"[GPT] Текст вложения обрезан: {len(text)} → {len(fitted)} символов (бюджет {budget} токенов)")
+        return fitted
+
+    async def edit_text_with_action(self, text: str, action: str, nco_info: Optional[dict] = None, style: Optional[str] = None,
+                                    use_cache: bool = True) -> str:
+        prompt = self.prompts.edit_request(text, action, style)
+
+        # Кнопки приходят с эмодзи впереди, поэтому сравниваем по окончанию
+        if any(action.endswith(skip) for skip in self.cache_skip_actions):
+            use_cache = False
+        return await self._run(self._text_prompt(prompt, nco_info), use_cache, kind='edit')
+
+    async def edit_text(self, text: str, nco_info: Optional[dict] = None) -> str:
+        return await self.edit_text_with_action(text, "default", nco_info)
+
+    async def generate_content_plan(
         self,
         period: str,
         frequency: str,
         nco_info: Optional[dict] = None,
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
-        theme: Optional[str] = None
+        theme: Optional[str] = None,
+        use_cache: bool = True
     ) -> str:
+        parts = self._plan_prompts(period, frequency, nco_info, start_date, end_date, theme)
+        if len(parts) == 1:
+            return await self._run(parts[0][0], use_cache, kind='plan')
+        plan = ""
+        async for plan in self._run_plan_chunks(parts, use_cache):
+            pass
+        return plan
+
+    def stream_content_plan(
+        self,
+        period: str,
+        frequency: str,
+        nco_info: Optional[dict] = None,
+        start_date: Optional[datetime.date] = None,
+        end_date: Optional[datetime.date] = None,
+        theme: Optional[str] = None,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        parts = self._plan_prompts(period, frequency, nco_info, start_date, end_date, theme)
+        if len(parts) == 1:
+            return self._stream(parts[0][0], use_cache, kind='plan')
+        return self._run_plan_chunks(parts, use_cache)
+
+    async def _run_plan_chunks(self, parts: list[tuple[Prompt, list]], use_cache: bool = True) -> AsyncIterator[str]:
+        """Генерирует части плана параллельно и отдаёт склейку готовых частей по мере их завершения."""
+        semaphore = asyncio.Semaphore(self.plan_chunk_concurrency)
+        done: list[Optional[tuple[list, Optional[str]]]] = [None] * len(parts)
+
+        async def run_chunk(i: int, prompt: str):
+            async with semaphore:
+                try:
+                    return i, await self._run(prompt, use_cache, kind='plan')
+                except GenerationError as e:
+                    # Остальные части плана ещё могут прийти — отказ одной не роняет весь план
+                    return i, e
+
+        failed = 0
+
+        tasks = [asyncio.create_task(run_chunk(i, prompt)) for i, (prompt, _) in enumerate(parts)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, text = await next_done
+                if isinstance(text, GenerationError):
+                    failed += 1
+                    if failed == len(parts):
+                        raise text
+                    text = None
+                done[i] = (parts[i][1], text)
+                yield merge_plan_chunks([chunk for chunk in done if chunk is not None])
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _plan_prompts(
+        self,
+        period: str,
+        frequency: str,
+        nco_info: Optional[dict] = None,
+        start_date: Optional[datetime.date] = None,
+        end_date: Optional[datetime.date] = None,
+        theme: Optional[str] = None
+    ) -> list[tuple[Prompt, list]]:
+        """Промты частей плана вместе с датами, которые покрывает каждая часть."""
         if start_date is None:
             start_date = datetime.now().date()
 
@@ -113,7 +361,7 @@ class TextService:
         else:
             num_posts = 4
 
-        num_posts = min(num_posts, 60)
+        num_posts = min(num_posts, self.plan_max_posts)
 
         # Равномерно распределяем даты
         if num_posts == 1:
@@ -125,36 +373,28 @@ class TextService:
                 for i in range(num_posts)
             ]
 
-        context = ""
-        if nco_info and any(nco_info.values()):
-            context = (
-                f"Информация об НКО:\n"
-                f"* Название: {nco_info.get('name', '')}\n"
-                f"* Деятельность: {nco_info.get('activities', '')}\n"
-                f"* Аудитория: {nco_info.get('audience', '')}\n"
-                f"* Сайт: {nco_info.get('website', '')}\n\n"
-            )
-
-        theme_hint = f"Тема: {theme}\n" if theme else ""
         period_desc = period if period != "custom" else f"с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}"
 
-        prompt = (
-            f"{self.system_prompt}\n\n"
-            f"{context}"
-            f"{theme_hint}"
-            f"Составь контент-план на {period_desc} с частотой «{normalized}», начиная с {start_date.strftime('%d.%m.%Y')}.\n"
-            f"Даты публикаций: {', '.join(d.strftime('%d.%m') for d in post_dates)}\n"
-            f"Для каждой даты: 1 идея поста (тип + краткое описание). Всего {num_posts} идей.\n"
-            f"Формат: [дд.мм] — Тип: Краткое описание (1-2 предложения)"
-        )
-
-        result = self.model.run(prompt)
-        return result.alternatives[0].text.strip()
+        # Длинный план режем на части по датам: каждая часть — отдельный короткий запрос
+        size = self.plan_chunk_size
+        chunks = [post_dates[i:i + size] for i in range(0, len(post_dates), size)]
+        parts = []
+        for n, dates in enumerate(chunks, 1):
+            part_hint = f"Это часть {n} из {len(chunks)} общего плана, придумай для неё свои, неповторяющиеся идеи.\n" if len(chunks) > 1 else ""
+            prompt = self.prompts.plan(
+                nco_info, theme, period_desc, normalized,
+                start=start_date.strftime('%d.%m.%Y'),
+                dates=', '.join(d.strftime('%d.%m') for d in dates),
+                count=len(dates),
+                part_hint=part_hint
+            )
+            parts.append((prompt, dates))
+        return parts
 
-    def check_health(self) -> bool:
+    async def check_health(self) -> bool:
         try:
-            result = self.model.run("Ответь одним словом: ок")
-            return "ок" in result.alternatives[0].text.lower()
+            answer = await self._run("Ответь одним словом: ок", use_cache=False)
+            return "ок" in answer.lower()
         except Exception as e:
             print(f"Health check error: {e}")
             return False